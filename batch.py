@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+#
+# PyOCV - Python OpenCV
+# batch.py - Headless Batch Processing
+#
+# Author: Anders Evenrud <andersevenrud@gmail.com>
+# License: Simple BSD
+#
+
+# Dependencies
+import cv
+import os
+import sys
+import glob
+import json
+import argparse
+import functools
+import multiprocessing
+
+# Locals
+from ocv import *
+from config import *
+from main import TrackerImage
+
+# ########################################################################### #
+# WORKERS                                                                     #
+# ########################################################################### #
+
+# Per-process state (see init())
+worker = {}
+
+def init(options):
+    """Initialize a worker process"""
+    worker["pid"]      = os.getpid()
+    worker["options"]  = options
+    worker["storage"]  = OCVStorages.get()
+    worker["pipeline"] = OCVPointPipeline()
+    worker["gates"]    = {}
+    worker["reader"]   = OCVTextRegionReader()
+    worker["scene"]    = OCVSceneGate() if options["scene"] else None
+
+def analyze(frame, noclone = False):
+    """ Run the TrackerImage preprocessing and detection on a single frame
+        - With 'noclone' the frame is modified in place
+    """
+    options = worker["options"]
+    img     = TrackerImage(frame, options["capture"], options["image"], worker["pipeline"], noclone, worker["scene"])
+    result  = {}
+
+    if options["haars"]:
+        result["objects"] = []
+        for haar in options["haars"]:
+            gate = None
+            if options["motion"]:
+                gate = worker["gates"].setdefault(haar, OCVMotionGate())
+
+            for (rect, n) in img.objects(worker["storage"], haar, gate):
+                result["objects"].append({"cascade": haar, "rect": rect, "neighbors": n})
+
+    if options["text"]:
+        result["text"] = img.read_text(options["psm"], options["lang"])
+
+    if options["regions"]:
+        result["regions"] = img.read_text(None, options["lang"], worker["reader"])
+
+    img.release()
+    return result
+
+def analyze_with(options, frame):
+    """Like analyze(), but initializes the calling process on first use"""
+    if worker.get("pid") != os.getpid():
+        init(options)
+    return analyze(frame)
+
+def process_range(job):
+    """Process frames [start, stop) of a video file"""
+    path, start, stop = job
+    for gate in worker["gates"].values():
+        gate.reset()
+    if worker["scene"] is not None:
+        worker["scene"].reset()
+
+    capture = OCVCapture(path)
+    if start:
+        capture.property(cv.CV_CAP_PROP_POS_FRAMES, start)
+
+    results = []
+    index   = start
+    while stop is None or index < stop:
+        frame = capture.poll()
+        if frame is None:
+            break
+
+        result = analyze(frame)
+        result["file"]  = path
+        result["frame"] = index
+        results.append(result)
+        index += 1
+
+    return results
+
+def load_image(path):
+    """Load an image as a BGR frame (falls back to PIL for formats OpenCV can not read)"""
+    try:
+        frame = cv.LoadImage(path, cv.CV_LOAD_IMAGE_COLOR)
+    except IOError:
+        frame = None
+
+    if frame is None and Image is not None:
+        frame = OCVPILImage(path)
+        if frame.nChannels == 1:
+            color = cv.CreateImage((frame.width, frame.height), cv.IPL_DEPTH_8U, 3)
+            cv.CvtColor(frame, color, cv.CV_GRAY2BGR)
+            frame = color
+
+    if frame is None:
+        raise IOError("Cannot read image '%s'" % path)
+    return frame
+
+def process_images(paths):
+    """Process a list of image files"""
+    results = []
+    for path in paths:
+        try:
+            # The loaded frame is not used for anything else, modify it in place
+            result = analyze(load_image(path), True)
+        except Exception, e:
+            result = {"error": str(e)}
+
+        result["file"] = path
+        results.append(result)
+
+    return results
+
+# ########################################################################### #
+# JOBS                                                                        #
+# ########################################################################### #
+
+def video_ranges(paths, chunk):
+    """Split video files into frame ranges of 'chunk' frames"""
+    for path in paths:
+        count = int(OCVCapture(path).property(cv.CV_CAP_PROP_FRAME_COUNT) or 0)
+        if count <= 0:
+            # Unknown length, process the whole file in one go
+            yield (path, 0, None)
+            continue
+
+        for start in range(0, count, chunk):
+            yield (path, start, min(start + chunk, count))
+
+def image_paths(specs, skip = ()):
+    """ Iterate image files in directories (recursively) and/or glob patterns
+        - Files in 'skip' are left out (see checkpoint())
+    """
+    for spec in specs:
+        if os.path.isdir(spec):
+            paths = (os.path.join(root, name) for root, dirs, files in os.walk(spec) for name in sorted(files))
+        else:
+            paths = glob.iglob(spec)
+
+        for path in paths:
+            if path not in skip and os.path.splitext(path)[1].lower() in BATCH_IMAGE_TYPES:
+                yield path
+
+def chunks(items, size):
+    """Group an iterable into lists of 'size' items"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+def checkpoint(path):
+    """ Get the files already processed in a JSON Lines output
+        - A partially written last line (after a crash) is truncated
+    """
+    done = set()
+    if not os.path.exists(path):
+        return done
+
+    with open(path, "r+b") as f:
+        size = 0
+        for line in iter(f.readline, ""):
+            try:
+                if not line.endswith("\n"):
+                    raise ValueError("Incomplete line")
+                done.add(json.loads(line)["file"])
+            except (ValueError, KeyError):
+                break
+            size += len(line)
+
+        f.truncate(size)
+
+    return done
+
+def run(jobs, func, options, processes = None, out = sys.stdout):
+    """Run jobs on a process pool and stream results as JSON Lines"""
+    pool = multiprocessing.Pool(processes, init, (options,))
+    try:
+        for results in pool.imap(func, jobs):
+            for result in results:
+                out.write(json.dumps(result) + "\n")
+            out.flush()
+    finally:
+        pool.close()
+        pool.join()
+
+def run_sources(sources, options, out = sys.stdout, every = 100):
+    """Process live sources in parallel (see OCVSourcePool) and stream results as JSON Lines"""
+    app = OCVApplication(sources=sources, pipeline=functools.partial(analyze_with, options))
+    try:
+        for count, event in enumerate(app.events(), 1):
+            result = event.pop("result")
+            result.update(event)
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+
+            if count % every == 0:
+                sources_stats(app.sources)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        app.stop()
+        sources_stats(app.sources)
+
+def run_bus(name, options, out = sys.stdout, every = 100):
+    """Process frames published on a frame bus (see OCVFrameBus) and stream results as JSON Lines"""
+    init(options)
+    bus = OCVFrameSubscriber(name)
+    try:
+        while True:
+            frame = bus.read(1.0, copy=True)
+            if frame is None:
+                if not os.path.exists(OCVFrameBusPath(name)):
+                    break
+                continue
+
+            # A validated copy, analyze() can modify it in place
+            seq, stamp, img = frame
+            result = analyze(img.frame, True)
+            result["seq"]  = seq
+            result["time"] = stamp
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+
+            if bus.frames % every == 0:
+                sys.stderr.write("%s\n" % bus.stats())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sys.stderr.write("%s\n" % bus.stats())
+        bus.close()
+
+def sources_stats(pool):
+    """Print per-source throughput"""
+    for s in pool.stats():
+        sys.stderr.write("%-20s %8d frames %6.1f fps %6.3f s latency\n" % (s["source"], s["frames"], s["fps"], s["latency"]))
+
+# ########################################################################### #
+# MAIN                                                                        #
+# ########################################################################### #
+
+def arguments():
+    """Parse command line"""
+    parser = argparse.ArgumentParser(description='PyOCV Batch Processing')
+    parser.add_argument('videos', nargs='*',
+                       help='video file(s) to process')
+    parser.add_argument('--bus', action='store', default=None,
+                       help='process frames published on this frame bus (see main.py --bus)')
+    parser.add_argument('--images', action='append', default=[],
+                       help='process image files in this directory or glob pattern (can be repeated)')
+    parser.add_argument('--resume', action='store_true',
+                       help='skip images already in --output and append to it')
+    parser.add_argument('--source', action='append', default=[],
+                       help='process a live source (device id or file) in real time (can be repeated)')
+    parser.add_argument('--jobs', action='store', type=int, default=None,
+                       help='number of worker processes (default: one per core)')
+    parser.add_argument('--chunk', action='store', type=int, default=BATCH_CHUNK,
+                       help='number of frames per job (default: %d)' % BATCH_CHUNK)
+    parser.add_argument('--output', action='store', default=None,
+                       help='write JSON Lines to this file (default: stdout)')
+    parser.add_argument('--haar', action='append', default=[],
+                       help='detect objects with this cascade (index or name, can be repeated)')
+    parser.add_argument('--motion', action='store_true',
+                       help='only detect objects in areas that changed')
+    parser.add_argument('--scene', action='store_true',
+                       help='reuse results while the scene is unchanged')
+    parser.add_argument('--text', action='store_true',
+                       help='read text with Tesseract')
+    parser.add_argument('--regions', action='store_true',
+                       help='read text region by region (with coordinates)')
+    parser.add_argument('--psm', action='store', type=int, default=DEFAULT_PSM,
+                       help='Tesseract page segmentation mode (default: %d)' % DEFAULT_PSM)
+    parser.add_argument('--lang', action='store', default=None,
+                       help='Tesseract language')
+    parser.add_argument('--original', action='store_true',
+                       help='do not modify frames before detection')
+    parser.add_argument('--color', action='store_true',
+                       help='do not convert frames to B&W (Type/Threshold/Equalize)')
+    parser.add_argument('--type', action='store', type=int, default=DEFAULT_TYPE, choices=range(5),
+                       help='threshold type of the B&W conversion (default: %d)' % DEFAULT_TYPE)
+    parser.add_argument('--threshold', action='store', type=int, default=DEFAULT_THRESHOLD,
+                       help='threshold of the B&W conversion, 0-255 (default: %d)' % DEFAULT_THRESHOLD)
+    parser.add_argument('--equalize', action='store_true', default=bool(DEFAULT_EQUALIZE),
+                       help='equalize the histogram of B&W frames')
+    parser.add_argument('--brightness', action='store', type=int, default=DEFAULT_BRIGHTNESS,
+                       help='brightness adjustment, 0-200 (default: %d)' % DEFAULT_BRIGHTNESS)
+    parser.add_argument('--contrast', action='store', type=int, default=DEFAULT_CONTRAST,
+                       help='contrast adjustment, 0-200 (default: %d)' % DEFAULT_CONTRAST)
+
+    args = parser.parse_args()
+    if args.resume and not args.output:
+        parser.error("--resume needs --output (the file to skip and append to)")
+    return args
+
+def options(args):
+    """Get worker options from command line"""
+    haars = []
+    for haar in args.haar:
+        haars.append(int(haar) if haar.isdigit() else haar)
+
+    return {
+        "capture" : {
+            "CaptureModify"  : not args.original,
+            "CaptureBW"      : not args.color
+        },
+        "image"   : {
+            "Type"           : args.type,
+            "Threshold"      : args.threshold,
+            "Equalize"       : int(args.equalize),
+            "Brightness"     : args.brightness,
+            "Contrast"       : args.contrast
+        },
+        "haars"   : haars,
+        "motion"  : args.motion,
+        "scene"   : args.scene,
+        "text"    : args.text,
+        "regions" : args.regions,
+        "psm"     : args.psm,
+        "lang"    : args.lang
+    }
+
+if __name__ == "__main__":
+    args = arguments()
+    out  = sys.stdout
+    done = set()
+    if args.output:
+        if args.resume:
+            done = checkpoint(args.output)
+        out = open(args.output, "a" if args.resume else "w")
+
+    if args.bus:
+        run_bus(args.bus, options(args), out)
+    elif args.source:
+        sources = [int(s) if s.isdigit() else s for s in args.source]
+        run_sources(sources, options(args), out)
+    elif args.images:
+        run(chunks(image_paths(args.images, done), BATCH_IMAGE_CHUNK), process_images, options(args), args.jobs, out)
+    else:
+        run(video_ranges(args.videos, args.chunk), process_range, options(args), args.jobs, out)
@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+#
+# PyOCV - Python OpenCV
+# bench.py - Benchmarks
+#
+# Author: Anders Evenrud <andersevenrud@gmail.com>
+# License: Simple BSD
+#
+
+# Dependencies
+import cv
+import os
+import sys
+import glob
+import json
+import time
+import resource
+import argparse
+import tempfile
+
+from collections import OrderedDict
+
+# Locals
+import ocv
+from ocv import *
+from config import *
+from main import TrackerImage
+
+# Synthetic frame sizes
+SIZES = OrderedDict([
+    ("vga",   (640, 480)),
+    ("720p",  (1280, 720)),
+    ("1080p", (1920, 1080)),
+    ("4k",    (3840, 2160))
+])
+
+# Settings used for the TrackerImage pipeline
+CAPTURE_SETTINGS = {
+    "CaptureModify"  : True,
+    "CaptureBW"      : True
+}
+
+IMAGE_SETTINGS = {
+    "Type"           : DEFAULT_TYPE,
+    "Threshold"      : DEFAULT_THRESHOLD,
+    "Equalize"       : 1,
+    "Brightness"     : 20,
+    "Contrast"       : 20
+}
+
+# ########################################################################### #
+# HELPERS                                                                     #
+# ########################################################################### #
+
+def measure(fn, repeat = 100, warmup = 10):
+    """Run 'fn' and return the sorted time of every call in seconds"""
+    for i in range(warmup):
+        fn()
+
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        fn()
+        times.append(time.time() - start)
+    return sorted(times)
+
+def median(times):
+    """Get the median of sorted times"""
+    return times[len(times) / 2]
+
+def memory():
+    """Get the peak resident size in KiB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def synthetic(size, channels = 3, seed = 0):
+    """Create a frame filled with (reproducible) noise"""
+    frame = cv.CreateImage(size, cv.IPL_DEPTH_8U, channels)
+    cv.RandArr(cv.RNG(seed), frame, cv.CV_RAND_UNI, cv.ScalarAll(0), cv.ScalarAll(255))
+    return frame
+
+def report(name, seconds, extra = ""):
+    """Print a result line"""
+    print "%-40s %10.3f ms %s" % (name, seconds * 1000., extra)
+
+def overlap(a, b):
+    """Intersection over union of two rectangles"""
+    w = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+    h = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+    if w <= 0 or h <= 0:
+        return 0.
+    i = float(w * h)
+    return i / (a[2] * a[3] + b[2] * b[3] - i)
+
+def tesseract_stub():
+    """Create a local executable that stands in for Tesseract"""
+    fd, path = tempfile.mkstemp(prefix="pyocv-tesseract-", suffix=".sh")
+    os.write(fd, "#!/bin/sh\necho 'PyOCV benchmark' > \"$2.txt\"\n")
+    os.close(fd)
+    os.chmod(path, 0755)
+    return path
+
+# ########################################################################### #
+# BENCHMARKS                                                                  #
+# ########################################################################### #
+
+def bench_numpy(size, repeat):
+    """ Frame <=> Numpy conversions (copying vs. shared memory)
+        - Sharing is measured by writing through the result, copies are not counted
+    """
+
+    def legacy_array(im):
+        # The old tostring()/fromstring() round-trip
+        a = np.fromstring(im.tostring(), dtype='uint8', count=im.width*im.height*im.nChannels)
+        a.shape = (im.height, im.width, im.nChannels)
+        return a
+
+    def legacy_image(a):
+        # tostring() + SetData()
+        im = cv.CreateImageHeader((a.shape[1], a.shape[0]), cv.IPL_DEPTH_8U, a.shape[2])
+        cv.SetData(im, a.tostring(), a.shape[1] * a.shape[2])
+        return im
+
+    def shared(im, a):
+        # Write through the array and see if the frame follows
+        old = a[0, 0, 0]
+        a[0, 0, 0] = 255 - old
+        result = cv.Get2D(im, 0, 0)[0] == a[0, 0, 0]
+        a[0, 0, 0] = old
+        return result
+
+    frame = synthetic(size)
+    roi   = cv.GetSubRect(frame, (size[0] / 4, size[1] / 4, size[0] / 2, size[1] / 2))
+    array = OCVNumpyArray(frame)
+
+    print "Numpy bridge (%dx%d):" % size
+    for name, fn, src, dst in (
+            ("legacy frame -> array", lambda: legacy_array(frame), frame, lambda: legacy_array(frame)),
+            ("legacy array -> frame", lambda: legacy_image(array), None, None),
+            ("frame -> array", lambda: OCVNumpyArray(frame), frame, lambda: OCVNumpyArray(frame)),
+            ("sub-rect -> array", lambda: OCVNumpyArray(roi), roi, lambda: OCVNumpyArray(roi)),
+            ("array -> frame", lambda: OCVNumpyImage(array), None, None)):
+
+        if src is not None:
+            share = shared(src, dst())
+        else:
+            im    = fn()
+            share = shared(im, array)
+
+        report(name, median(measure(fn, repeat)), "shared=%s" % share)
+
+def primitives(size):
+    """Get (name, fn) of every ocv.py primitive for given frame size"""
+    frame     = synthetic(size)
+    gray      = synthetic(size, 1)
+    work      = OCVCloneImage(frame)
+    preview   = OCVFrames.acquire((320, 240), cv.IPL_DEPTH_8U, 3)
+    engine    = OCVHistogramEngine(64, (320, 240))
+    pipeline  = OCVPointPipeline()
+    pipeline.update(IMAGE_SETTINGS["Threshold"], IMAGE_SETTINGS["Type"], IMAGE_SETTINGS["Equalize"],
+                    IMAGE_SETTINGS["Brightness"], IMAGE_SETTINGS["Contrast"])
+
+    def histogram():
+        OCVFrames.release(OCVHistogram(frame))
+
+    def pipeline_apply():
+        cv.Copy(gray, work_gray)
+        pipeline.apply(work_gray)
+
+    work_gray = OCVCloneImage(gray)
+    result = [
+        ("OCVCloneImage",         lambda: OCVFrames.release(OCVCloneImage(frame))),
+        ("OCVCopyGrayscale",      lambda: OCVFrames.release(OCVCopyGrayscale(frame))),
+        ("OCVResizeImage",        lambda: OCVResizeImage(frame, (320, 240), preview)),
+        ("OCVBrightnessContrast", lambda: OCVBrightnessContrast(work, 20, 20)),
+        ("OCVHistogram",          histogram),
+        ("OCVPointPipeline",      pipeline_apply)
+    ]
+
+    if np is not None:
+        result.append(("OCVHistogramEngine", lambda: engine.render(frame)))
+
+    return result
+
+def pipelines(size, haar, text):
+    """Get (name, fn) of the end-to-end TrackerImage paths for given frame size"""
+    frame    = synthetic(size)
+    storage  = cv.CreateMemStorage(0)
+    pipeline = OCVPointPipeline()
+
+    def preprocess():
+        TrackerImage(frame, CAPTURE_SETTINGS, IMAGE_SETTINGS, pipeline).release()
+
+    def detect():
+        img = TrackerImage(frame, CAPTURE_SETTINGS, IMAGE_SETTINGS, pipeline)
+        img.objects(storage, haar)
+        img.release()
+
+    def read():
+        img = TrackerImage(frame, CAPTURE_SETTINGS, IMAGE_SETTINGS, pipeline)
+        OCVReadText(img.frame)
+        img.release()
+
+    result = [("TrackerImage", preprocess)]
+    if haar is not None:
+        result.append(("TrackerImage + OCVObjects", detect))
+    if text:
+        result.append(("TrackerImage + OCVReadText (stub)", read))
+
+    return result
+
+def bench_detector(frames, haar, scales, repeat, warmup, canny = False):
+    """ Time OCVDetector at every scale and get its recall
+        - Recall is the share of full resolution detections found again (IoU >= 0.5)
+    """
+    reference = OCVDetector(1.0, canny=canny)
+    expected  = [[rect for (rect, n) in reference.detect(frame, haar)] for frame in frames]
+    total     = sum([len(e) for e in expected])
+    reference.release()
+
+    print "OCVDetector (%d frames, %d objects at full resolution):" % (len(frames), total)
+    results = OrderedDict()
+    for scale in scales:
+        detector = OCVDetector(scale, canny=canny)
+
+        def detect():
+            for frame in frames:
+                detector.detect(frame, haar)
+
+        t     = median(measure(detect, repeat, warmup)) / len(frames)
+        found = 0
+        for frame, rects in zip(frames, expected):
+            got    = [rect for (rect, n) in detector.detect(frame, haar)]
+            found += len([r for r in rects if [g for g in got if overlap(r, g) >= 0.5]])
+        detector.release()
+
+        key = "OCVDetector scale=%.2f%s" % (scale, " canny" if canny else "")
+        results[key] = {
+            "ms"      : t * 1000.,
+            "fps"     : 1. / t if t else 0.,
+            "recall"  : float(found) / total if total else 1.
+        }
+
+        report(key, t, "%8.1f fps recall %5.1f%%" % (results[key]["fps"], results[key]["recall"] * 100.))
+
+    return results
+
+def bench_cascades(frames, haars, threads, repeat, warmup):
+    """ Time OCVMultiDetector one cascade after the other and in a thread pool
+        - The pool is only worth enabling (HAAR_THREADS) if it beats the sequential run
+    """
+    print "OCVMultiDetector (%d frames, %d cascades):" % (len(frames), len(haars))
+    results = OrderedDict()
+    for count in (1, threads):
+        multi = OCVMultiDetector(haars, threads=count)
+
+        def detect():
+            for frame in frames:
+                multi.detect(frame)
+
+        t = median(measure(detect, repeat, warmup)) / len(frames)
+        multi.close()
+
+        key = "OCVMultiDetector threads=%d" % count
+        results[key] = {
+            "ms"      : t * 1000.,
+            "fps"     : 1. / t if t else 0.
+        }
+
+        extra = "%8.1f fps" % results[key]["fps"]
+        if count > 1:
+            base   = results["OCVMultiDetector threads=1"]["ms"]
+            extra += " speedup %.2fx" % (base / results[key]["ms"] if results[key]["ms"] else 0.)
+        report(key, t, extra)
+
+        if threads <= 1:
+            break
+
+    return results
+
+def bench_suite(sizes, repeat, warmup, haar, text):
+    """Time every primitive and pipeline at every size. Returns {name: result}"""
+    results = OrderedDict()
+    for label in sizes:
+        size   = SIZES[label]
+        pixels = size[0] * size[1]
+        print "Frame %s (%dx%d):" % (label, size[0], size[1])
+
+        for name, fn in primitives(size) + pipelines(size, haar, text):
+            before = memory()
+            times  = measure(fn, repeat, warmup)
+            t      = median(times)
+            key    = "%s@%s" % (name, label)
+
+            results[key] = {
+                "ms"      : t * 1000.,
+                "fps"     : 1. / t if t else 0.,
+                "mpix"    : pixels / t / 1e6 if t else 0.,
+                "rss"     : memory() - before
+            }
+
+            report(key, t, "%8.1f fps %8.1f MPix/s %+6d KiB" % (results[key]["fps"], results[key]["mpix"], results[key]["rss"]))
+
+    return results
+
+def compare(results, baseline, threshold):
+    """Compare results with a baseline. Returns the names of regressions"""
+    regressions = []
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+
+        old = baseline[key]["ms"]
+        if old > 0 and result["ms"] > old * (1. + threshold):
+            regressions.append(key)
+            print "REGRESSION %-40s %10.3f ms -> %10.3f ms (%+.0f%%)" % (key, old, result["ms"], (result["ms"] / old - 1.) * 100.)
+
+    return regressions
+
+# ########################################################################### #
+# MAIN                                                                        #
+# ########################################################################### #
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='PyOCV Benchmarks')
+    parser.add_argument('--suite', action='store', default='all', choices=['all', 'numpy', 'primitives', 'detector'],
+                       help='what to run (default: all)')
+    parser.add_argument('--sizes', action='store', default=",".join(SIZES.keys()),
+                       help='comma separated frame sizes (default: %s)' % ",".join(SIZES.keys()))
+    parser.add_argument('--repeat', action='store', type=int, default=20,
+                       help='number of timed runs per benchmark (default: 20)')
+    parser.add_argument('--warmup', action='store', type=int, default=3,
+                       help='number of untimed runs per benchmark (default: 3)')
+    parser.add_argument('--haar', action='store', default=None,
+                       help='also time detection with this cascade (index or name)')
+    parser.add_argument('--scales', action='store', default="1.0,0.75,0.5,0.35,0.25",
+                       help='comma separated detection scales for the detector suite (default: 1.0,0.75,0.5,0.35,0.25)')
+    parser.add_argument('--images', action='store', default=None,
+                       help='glob of images for the detector suite (default: a synthetic frame, recall is meaningless)')
+    parser.add_argument('--canny', action='store_true',
+                       help='use Canny pruning in the detector suite')
+    parser.add_argument('--cascades', action='store', default=None,
+                       help='comma separated cascades (index or name) to time sequential against pooled in the detector suite')
+    parser.add_argument('--threads', action='store', type=int, default=4,
+                       help='pool size for the --cascades comparison (default: 4)')
+    parser.add_argument('--text', action='store_true',
+                       help='also time OCR (with a local Tesseract stub)')
+    parser.add_argument('--save', action='store', default=None,
+                       help='write results to this baseline file')
+    parser.add_argument('--baseline', action='store', default=None,
+                       help='compare results with this baseline file')
+    parser.add_argument('--threshold', action='store', type=float, default=0.1,
+                       help='slowdown that counts as a regression (default: 0.1)')
+
+    args  = parser.parse_args()
+    sizes = [s for s in args.sizes.split(",") if s]
+    haar  = args.haar
+    if haar is not None and haar.isdigit():
+        haar = int(haar)
+
+    if args.suite in ("all", "numpy") and np is not None:
+        bench_numpy(SIZES[sizes[0]], args.repeat)
+
+    results = OrderedDict()
+    if args.suite in ("all", "primitives"):
+        stub = None
+        if args.text:
+            stub = ocv.TESSERACT_BIN = tesseract_stub()
+
+        try:
+            results.update(bench_suite(sizes, args.repeat, args.warmup, haar, args.text))
+        finally:
+            if stub is not None:
+                os.unlink(stub)
+
+    if args.suite in ("all", "detector") and (haar is not None or args.cascades):
+        if args.images:
+            frames = [cv.LoadImage(p, cv.CV_LOAD_IMAGE_COLOR) for p in sorted(glob.glob(args.images))]
+        else:
+            frames = [synthetic(SIZES[sizes[0]])]
+
+        if haar is not None:
+            scales = [float(s) for s in args.scales.split(",") if s]
+            results.update(bench_detector(frames, haar, scales, args.repeat, args.warmup, args.canny))
+
+        if args.cascades:
+            haars = [int(h) if h.isdigit() else h for h in args.cascades.split(",") if h]
+            results.update(bench_cascades(frames, haars, args.threads, args.repeat, args.warmup))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
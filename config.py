@@ -14,6 +14,45 @@ DEFAULT_TMP         = os.getcwd()
 DEFAULT_DEV         = 0
 DEFAULT_DEV_WIDTH   = 640
 DEFAULT_DEV_HEIGHT  = 480
+CAPTURE_BUFFER      = 0
+CAPTURE_MODE        = "latest"
+FRAME_POOL_LIMIT    = 4
+FRAME_POOL_BYTES    = 64 * 1024 * 1024
+FRAME_POOL_OWNED    = 64
+MEMORY_INTERVAL     = 100
+MEMORY_GROWTH       = 0.1
+SOURCE_QUEUE        = 256
+SOURCE_LATENCY      = 0.2
+BATCH_CHUNK         = 250
+BATCH_IMAGE_CHUNK   = 16
+BATCH_IMAGE_TYPES   = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".pgm", ".ppm")
+VIDEO_QUEUE         = 8
+VIDEO_POLICY        = "block"
+VIDEO_FPS           = 30
+MJPEG_HOST          = "127.0.0.1"
+MJPEG_PORT          = 8080
+MJPEG_QUALITY       = 80
+BUS_SLOTS           = 4
+BUS_POLL            = 0.002
+BUS_PATH            = "/dev/shm" if os.path.isdir("/dev/shm") else DEFAULT_TMP
+PROFILE_ENABLED     = False
+PROFILE_WINDOW      = 300
+QUALITY_FPS         = 15
+QUALITY_WINDOW      = 30
+QUALITY_HEADROOM    = 0.3
+QUALITY_RECOVER     = 90
+QUALITY_STEPS       = [
+  ("preview",      15),
+  ("every",        2),
+  ("scale_factor", 1.3),
+  ("downscale",    0.75),
+  ("preview",      5),
+  ("every",        3),
+  ("scale_factor", 1.5),
+  ("downscale",    0.5),
+  ("capture",      0.75),
+  ("capture",      0.5)
+]
 DEFAULT_FLIP        = 0
 DEFAULT_TYPE        = 3
 DEFAULT_THRESHOLD   = 128
@@ -23,7 +62,41 @@ DEFAULT_HAAR        = 4
 DEFAULT_BRIGHTNESS  = 0
 DEFAULT_CONTRAST    = 0
 HAAR_PATH           = "/usr/share/opencv/haarcascades"
+HAAR_CACHE_SIZE     = 4
+HAAR_WARMUP         = [DEFAULT_HAAR]
+HAAR_SCALE          = 1.0
+HAAR_SCALE_FACTOR   = 1.2
+HAAR_NEIGHBORS      = 2
+HAAR_FLAGS          = 0
+HAAR_MIN_SIZE       = (20, 20)
+HAAR_MAX_SIZE       = None
+HAAR_THREADS        = 1
+TRACK_INTERVAL      = 10
+TRACK_DRIFT         = 0.5
+TRACK_POINTS        = 20
+TRACK_OVERLAP       = 0.3
+MOTION_ALPHA        = 0.2
+MOTION_THRESHOLD    = 25
+MOTION_PADDING      = 32
+MOTION_AREA         = 64
+SCENE_THRESHOLD     = 3.0
+SCENE_SIZE          = (32, 24)
 TESSERACT_BIN       = "tesseract"
+TESSERACT_POOL_SIZE = 2
+TESSERACT_TIMEOUT   = 10
+TESSERACT_TMP       = "/dev/shm" if os.path.isdir("/dev/shm") else DEFAULT_TMP
+TEXT_PENDING        = 1
+TEXT_POLICY         = "coalesce"
+TEXT_CACHE_SIZE     = 64
+TEXT_CACHE_TTL      = 600
+TEXT_CACHE_DISTANCE = 4
+TEXT_CACHE_PATH     = None
+TEXT_CACHE_STORE    = 4096
+TEXT_REGION_PSM     = 7
+TEXT_REGION_PADDING = 4
+TEXT_REGION_SIZE    = (16, 8)
+TEXT_REGION_FILL    = 0.3
+TEXT_REGION_JOIN    = 15
 
 HAARS = [
   "haarcascade_lowerbody",
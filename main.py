@@ -9,6 +9,8 @@
 
 # Dependencies
 import cv
+import os
+import time
 import pprint
 import argparse
 
@@ -23,43 +25,97 @@ from config import *
 # Class: TrackerImage
 class TrackerImage(OCVImage):
 
-    def __init__(self, frame, cap_settings, im_settings):
-        """Create and modify image"""
-        OCVImage.__init__(self, frame)
+    def __init__(self, frame, cap_settings, im_settings, pipeline = None, noclone = False, scene = None):
+        """ Create and modify image
+            - Pass a long-lived OCVPointPipeline to avoid rebuilding its table every frame
+            - With 'noclone' the given frame is modified in place
+            - With an OCVSceneGate detection results are reused while the scene is unchanged
+        """
+        OCVImage.__init__(self, frame, noclone=noclone)
+        self.scene     = scene
+        self.signature = None
 
         if cap_settings["CaptureModify"]:
+            if pipeline is None:
+                pipeline = OCVPointPipeline()
+
             if cap_settings["CaptureBW"]:
                 self.mode(1)
 
-                try:
-                    self.setThreshold(im_settings["Threshold"], im_settings["Type"])
-                except:
-                    pass
-
-                if im_settings["Equalize"]:
-                    self.equalize()
-
-
-            self.setBrightnessContrast(im_settings["Brightness"], im_settings["Contrast"])
-
-    def detect_text(self, font, psm, path_img, path_txt):
-        """Detect text"""
-        img   = OCVCloneImage(self.frame)
-        data  = OCVReadText(self.frame, path_img, path_txt, psm)
+                pipeline.update(im_settings["Threshold"], im_settings["Type"], im_settings["Equalize"],
+                                im_settings["Brightness"], im_settings["Contrast"])
+            else:
+                pipeline.update(brightness=im_settings["Brightness"], contrast=im_settings["Contrast"])
+
+            pipeline.apply(self.frame)
+
+        if scene is not None:
+            self.signature = scene.signature(self.frame)
+
+    def recall(self, key, compute):
+        """Get the result of 'compute()', reusing an earlier one while the scene is unchanged"""
+        if self.scene is None:
+            return compute()
+        return self.scene.recall(key, self.signature, compute)
+
+    def read_text(self, psm, lang = None, reader = None):
+        """ Get detected text
+            - With an OCVTextRegionReader a list of (text, (x, y, w, h)) regions is returned
+        """
+        if reader is not None:
+            return self.recall(("regions", psm, lang), lambda: reader.read(self.frame, psm, lang))
+        return self.recall(("text", psm, lang), lambda: OCVReadText(self.frame, psm=psm, lang=lang))
+
+    def detect_text(self, font, psm, lang = None, reader = None):
+        """ Detect text
+            - With an OCVTextRegionReader only candidate text regions are read
+        """
+        return self.render_text(self.read_text(psm, lang, reader), font)
+
+    def render_text(self, data, font):
+        """Render detected text (a string, or a list of (text, (x, y, w, h)) regions)"""
         pprint.pprint(data)
-        if data is None:
+        if not data:
             data = "Empty..."
 
-        result = OCVText(img, data, 10, 15, 15, font, True)
-
-        cv.Copy(result, img)
+        if isinstance(data, basestring):
+            return OCVText(self.frame, data, 10, 15, 15, font, True)
 
+        img = OCVCloneImage(self.frame)
+        for (text, (x, y, w, h)) in data:
+            cv.Rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 1)
+            cv.PutText(img, text, (x, max(10, y - 2)), font, (0, 255, 0))
         return img
 
-    def detect_objects(self, storage, haar):
-        """Detect objects"""
-        img     = OCVCloneImage(self.frame)
-        objects = OCVObjects(self.frame, storage, ("%s/%s.%s" % (HAAR_PATH, HAARS[haar], "xml")))
+    def objects(self, storage, haar, gate = None, scale = 1.0, scale_factor = HAAR_SCALE_FACTOR):
+        """ Get detected objects as a list of ((x, y, w, h), neighbors)
+            - With an OCVMotionGate only changed areas are searched
+            - With a 'scale' below 1.0 the cascade runs on a downscaled copy
+            - With an OCVSceneGate earlier objects are returned while the scene is unchanged
+        """
+        key    = ("objects", haar, scale, scale_factor)
+        detect = lambda frame, storage, haar: OCVObjects(frame, storage, haar, scale_factor, scale)
+        if gate is not None:
+            return self.recall(key, lambda: gate.detect(self.frame, storage, haar, detect))
+        return self.recall(key, lambda: detect(self.frame, storage, haar))
+
+    def detect_objects(self, storage, haar, tracker = None, font = None, gate = None, scale = 1.0, scale_factor = HAAR_SCALE_FACTOR):
+        """ Detect objects
+            - With an OCVObjectTracker the cascade only runs on key frames, objects are tracked in between
+            - With an OCVMotionGate only changed areas are searched
+        """
+        img = OCVCloneImage(self.frame)
+        if tracker is not None:
+            if font is None:
+                font = cv.InitFont(cv.CV_FONT_HERSHEY_PLAIN, 0.9, 0.9, 0, 1, 1)
+
+            for (id, (x, y, w, h)) in tracker.update(self, lambda: self.objects(storage, haar, gate, scale, scale_factor)):
+                cv.Rectangle(img, (x, y), (x + w, y + h), (0, 255, 0), 3)
+                cv.PutText(img, "#%d" % id, (x, max(10, y - 4)), font, (0, 255, 0))
+
+            return img
+
+        objects = self.objects(storage, haar, gate, scale, scale_factor)
         if objects:
             for ((x, y, w, h), n) in objects:
                 tl = (x + int(w*0.1), y + int(h*0.07))
@@ -68,26 +124,70 @@ class TrackerImage(OCVImage):
 
             return img
 
+        OCVFrames.release(img)
         return None
 
+    def detect_cascades(self, detector, font = None):
+        """Detect objects of every cascade of an OCVMultiDetector, labelled by cascade"""
+        if font is None:
+            font = cv.InitFont(cv.CV_FONT_HERSHEY_PLAIN, 0.9, 0.9, 0, 1, 1)
+
+        colors  = [(0, 255, 0), (255, 0, 0), (0, 0, 255), (0, 255, 255), (255, 0, 255), (255, 255, 0)]
+        objects = self.recall(("cascades", tuple(detector.names)), lambda: detector.detect(self.frame))
+        if not objects:
+            return None
+
+        img = OCVCloneImage(self.frame)
+        for (name, (x, y, w, h), n) in objects:
+            color = colors[detector.names.index(name) % len(colors)]
+            cv.Rectangle(img, (x, y), (x + w, y + h), color, 2)
+            cv.PutText(img, name.replace("haarcascade_", ""), (x, max(10, y - 4)), font, color)
+        return img
+
 # Class: Tracker
 class Tracker(OCVApplication):
 
-    def __init__(self, path, capture_id, capture_width, capture_height):
-        """Create new Application"""
-        self.path_img     = "%s/_output.jpg" % path
-        self.path_txt     = "%s/_output" % path
-        self.win_result   = ResultsWindow()
-        self.win_settings = SettingsWindow()
+    def __init__(self, capture_id, capture_width, capture_height, capture_buffer = CAPTURE_BUFFER, capture_mode = CAPTURE_MODE, sinks = None, fps = None, cascades = None, bus = None):
+        """ Create new Application
+            - 'sinks' is a (results, settings) pair of OCVSink instances (HighGUI windows by default)
+            - With 'fps' quality is lowered as needed to hold that frame rate (see OCVQualityController)
+            - 'cascades' is an OCVMultiDetector used for detecting all its cascades at once
+            - With 'bus' every captured frame is published on the OCVFrameBus of that name
+        """
+        if sinks is None:
+            sinks = (None, None)
+
+        self.win_result   = ResultsWindow(sinks[0])
+        self.win_settings = SettingsWindow(sinks[1])
+        self.pipeline     = OCVPointPipeline()
+        self.tracker      = OCVObjectTracker()
+        self.gate         = OCVMotionGate()
+        self.scene        = OCVSceneGate()
+        self.memory       = OCVMemoryMonitor()
+        self.cascades     = cascades
+        self.bus_name     = bus
+        self.bus          = None
+        self.bus_frame    = None
+        self.histogram    = OCVHistogramEngine(64, (320, 240))
+        self.texts        = OCVTextQueue(OCVTextRegionReader(), cache=OCVTextCache())
 
         # Other settings are handled by GUI, these are key bindings
         self.settings = {
             "PreviewMode"    : 0,
             "CaptureModify"  : True,
-            "CaptureBW"      : True
+            "CaptureBW"      : True,
+            "Tracking"       : False,
+            "MotionGate"     : False,
+            "SceneGate"      : False,
+            "Profile"        : False
         }
 
-        OCVApplication.__init__(self, 0, capture_id, capture_width, capture_height)
+        OCVApplication.__init__(self, 0, capture_id, capture_width, capture_height, HAAR_WARMUP, capture_buffer, capture_mode)
+
+        self.quality   = None
+        self.sink_fps  = [w.sink.fps for w in (self.win_result, self.win_settings)]
+        if fps:
+            self.quality = OCVQualityController(fps, capture=self.capture, size=(capture_width, capture_height))
 
     def handleKey(self, k):
         """Handle Keyboard Input"""
@@ -100,6 +200,40 @@ class Tracker(OCVApplication):
         elif k == 102: # f
             print ">>> Detecting Object(s)..."
             return "object"
+        elif k == 97: # a
+            if self.cascades is None:
+                print ">>> No cascades given (see --haars)"
+            else:
+                print ">>> Detecting Object(s) of %d cascades..." % len(self.cascades.haars)
+                return "cascades"
+        elif k == 111: # o
+            self.settings["Tracking"] = not self.settings["Tracking"]
+            self.tracker.reset()
+            if self.settings["Tracking"]:
+                print ">>> Tracking: True"
+            else:
+                print ">>> Tracking: False"
+        elif k == 103: # g
+            self.settings["MotionGate"] = not self.settings["MotionGate"]
+            self.gate.reset()
+            if self.settings["MotionGate"]:
+                print ">>> Motion Gate: True"
+            else:
+                print ">>> Motion Gate: False"
+        elif k == 115: # s
+            self.settings["SceneGate"] = not self.settings["SceneGate"]
+            self.scene.reset()
+            if self.settings["SceneGate"]:
+                print ">>> Scene Gate: True"
+            else:
+                print ">>> Scene Gate: False"
+        elif k == 112: # p
+            self.settings["Profile"] = not self.settings["Profile"]
+            OCVStats.enabled = OCVStats.enabled or self.settings["Profile"]
+            if self.settings["Profile"]:
+                print ">>> Profile Overlay: True"
+            else:
+                print ">>> Profile Overlay: False"
         elif k == 116: # t
             self.settings["PreviewMode"] += 1
             if self.settings["PreviewMode"] > 1:
@@ -122,42 +256,152 @@ class Tracker(OCVApplication):
 
         return True
 
-    def run(self):
-        """Main Loop"""
+    def publish(self, frame):
+        """Publish a captured frame on the frame bus (at the size of the first frame)"""
+        if self.bus is None:
+            self.bus = OCVFrameBus(self.bus_name, (frame.width, frame.height), frame.nChannels, frame.widthStep)
 
-        pprint.pprint(self.capture.properties())
-
-        result = None
-        while 1:
-            # Get frame and key
-            frame, k = OCVApplication.run(self, self.win_settings.settings["Flip"])
-            if frame is None:
-                break
-
-            # Keyboard Handling
-            detect = self.handleKey(k)
-            if detect == False:
-                break
+        if (frame.width, frame.height) != self.bus.size:
+            # The capture size changed (see OCVQualityController), subscribers keep theirs
+            self.bus_frame = OCVFrames.reuse(self.bus_frame, self.bus.size, frame.depth, frame.nChannels)
+            frame = OCVResizeImage(frame, self.bus.size, self.bus_frame)
 
-            # Frame Handling
-            img = TrackerImage(frame, self.settings, self.win_settings.settings)
+        self.bus.publish(frame)
 
-            if detect == "text":
-                result = img.detect_text(self.font, self.win_settings.settings["Pagesegmode"], self.path_img, self.path_txt)
-            elif detect == "object":
-                result = img.detect_objects(self.storage, self.win_settings.settings["Haarcascade"])
+    def adjust(self):
+        """Apply the preview rate of the quality controller to the windows"""
+        preview = self.quality.settings["preview"]
+        for (window, fps) in zip((self.win_result, self.win_settings), self.sink_fps):
+            window.sink.fps = min([f for f in (fps, preview) if f] or [None])
 
-            # Output Handling
-            if self.settings["PreviewMode"] == 0:
-                self.win_settings.render(img.frame)
-            elif self.settings["PreviewMode"] == 1:
-                self.win_settings.render(img.getHistogram())
+    def run(self):
+        """Main Loop"""
 
-            if result is not None:
-                self.win_result.render(result)
+        pprint.pprint(self.capture.properties())
 
-        # Main loop break
-        self.stop()
+        result  = None
+        started = time.time()
+        try:
+            while 1:
+                # Get frame and key
+                frame, k = OCVApplication.run(self, self.win_settings.settings["Flip"])
+                if frame is None:
+                    break
+
+                if self.bus_name:
+                    self.publish(frame)
+
+                # Keyboard Handling
+                detect = self.handleKey(k)
+                if detect == False:
+                    break
+
+                # Frame Handling
+                with OCVStats.stage("preprocess"):
+                    scene = self.scene if self.settings["SceneGate"] else None
+                    img   = TrackerImage(frame, self.settings, self.win_settings.settings, self.pipeline, scene=scene)
+
+                # Text and cascade requests still go through while tracking
+                if self.settings["Tracking"] and detect in (None, "object"):
+                    detect = "track"
+
+                with OCVStats.stage("text_queue"):
+                    if detect == "text":
+                        key = ("regions", self.win_settings.settings["Pagesegmode"], None)
+                        if scene is None:
+                            self.texts.submit(img.frame, key[1])
+                        else:
+                            # Unchanged scenes are answered right away, see TrackerImage.read_text()
+                            found, data = scene.get(key, img.signature)
+                            if found:
+                                OCVFrames.release(result)
+                                result = img.render_text(data, self.font)
+                            else:
+                                self.texts.submit(img.frame, key[1], tag=(key, img.signature))
+
+                    for (tag, data) in self.texts.poll():
+                        if tag is not None:
+                            self.scene.put(tag[0], tag[1], data)
+
+                        OCVFrames.release(result)
+                        result = img.render_text(data, self.font)
+
+                scale        = 1.0
+                scale_factor = HAAR_SCALE_FACTOR
+                if self.quality is not None:
+                    scale        = self.quality.settings["downscale"]
+                    scale_factor = self.quality.settings["scale_factor"]
+                    if detect == "track" and not self.quality.due():
+                        detect = None
+
+                with OCVStats.stage("detect"):
+                    if detect in ("object", "track"):
+                        OCVFrames.release(result)
+                        gate    = self.gate if self.settings["MotionGate"] else None
+                        tracker = self.tracker if detect == "track" else None
+                        result  = img.detect_objects(self.storage, self.win_settings.settings["Haarcascade"], tracker, self.font, gate, scale, scale_factor)
+                    elif detect == "cascades":
+                        OCVFrames.release(result)
+                        result = img.detect_cascades(self.cascades, self.font)
+
+                # Output Handling
+                status = None
+                texts  = self.texts.stats()
+                if texts["running"] or texts["queued"]:
+                    status = "OCR: %d running, %d queued" % (texts["running"], texts["queued"])
+                elif scene is not None:
+                    status = "Scene: %d%% skipped" % (self.scene.stats()["ratio"] * 100)
+
+                profiler = OCVStats if self.settings["Profile"] else None
+                with OCVStats.stage("render"):
+                    if self.settings["PreviewMode"] == 0:
+                        self.win_settings.render(img.frame, status, profiler)
+                    elif self.settings["PreviewMode"] == 1 and self.win_settings.due():
+                        # Only draw the histogram when the sink takes a frame
+                        self.win_settings.render(self.histogram.render(img.frame), status, profiler)
+
+                    if result is not None:
+                        self.win_result.render(result)
+
+                img.release()
+                OCVFrames.tick()
+
+                dropped = None
+                if self.capture.reader is not None:
+                    dropped = self.capture.reader.dropped
+                OCVStats.tick(dropped)
+
+                if self.memory.tick():
+                    print ">>> Memory: new high-water mark %d KiB (started at %d KiB)" % (self.memory.high, self.memory.baseline)
+
+                # The whole iteration counts, including capture and key handling
+                now = time.time()
+                if self.quality is not None and self.quality.update(now - started):
+                    self.adjust()
+                started = now
+        except KeyboardInterrupt:
+            print "Interrupted..."
+        finally:
+            # Shutdown, also on Ctrl-C (the only way out without a window)
+            self.texts.cancel()
+            if self.cascades is not None:
+                self.cascades.close()
+            if self.bus is not None:
+                self.bus.close()
+            self.texts.cache.close()
+            print "Text cache: %s" % self.texts.cache.stats()
+            print "Frame pool: %s" % OCVFrames.stats()
+            print "Storage pool: %s" % OCVStorages.stats()
+            print "Memory: %s" % self.memory.stats()
+            if self.quality is not None:
+                print "Quality: %s" % self.quality.stats()
+            if self.scene.checks:
+                print "Scene gate: %s" % self.scene.stats()
+            if OCVStats.enabled:
+                pprint.pprint(OCVStats.report())
+            self.win_result.sink.close()
+            self.win_settings.sink.close()
+            self.stop()
 
 # ########################################################################### #
 # WINDOWS                                                                     #
@@ -165,19 +409,20 @@ class Tracker(OCVApplication):
 
 # Class: ResultsWindow
 class ResultsWindow(OCVWindow):
-    def __init__(self):
-        OCVWindow.__init__(self, "Results", 0, 0, 800, 600)
+    def __init__(self, sink = None):
+        OCVWindow.__init__(self, "Results", 0, 0, 800, 600, sink)
+        self.preview = None
 
     def render(self, frame = None):
         # We want a bigger preview
-        if frame is not None:
-            img = OCVResizeImage(frame, (800, 600))
-            OCVWindow.render(self, img)
+        if frame is not None and self.due():
+            self.preview = OCVFrames.reuse(self.preview, (800, 600), frame.depth, frame.nChannels)
+            OCVWindow.render(self, OCVResizeImage(frame, (800, 600), self.preview))
 
 # Class: SettingsWindow
 class SettingsWindow(OCVWindow):
-    def __init__(self):
-        OCVWindow.__init__(self, "Settings", 950, 0)
+    def __init__(self, sink = None):
+        OCVWindow.__init__(self, "Settings", 950, 0, None, None, sink)
 
         self.createTrackbar("Flip",         DEFAULT_FLIP,       1)
         self.createTrackbar("Type",         DEFAULT_TYPE,       4)
@@ -187,20 +432,56 @@ class SettingsWindow(OCVWindow):
         self.createTrackbar("Haarcascade",  DEFAULT_HAAR,       9)
         self.createTrackbar("Brightness",   DEFAULT_BRIGHTNESS, 200)
         self.createTrackbar("Contrast",     DEFAULT_CONTRAST,   200)
+        self.preview = None
+        self.font    = None
 
-    def render(self, frame):
+    def render(self, frame, status = None, profiler = None):
         # We want a smaller preview
-        img = OCVResizeImage(frame, (320, 240))
-        OCVWindow.render(self, img)
+        if not self.due():
+            return
+
+        self.preview = OCVFrames.reuse(self.preview, (320, 240), frame.depth, frame.nChannels)
+        OCVResizeImage(frame, (320, 240), self.preview)
+
+        if self.font is None:
+            self.font = cv.InitFont(cv.CV_FONT_HERSHEY_PLAIN, 0.9, 0.9, 0, 1, 1)
+
+        if status:
+            cv.PutText(self.preview, status, (5, 232), self.font, cv.ScalarAll(255))
+
+        if profiler is not None:
+            profiler.overlay(self.preview)
+
+        OCVWindow.render(self, self.preview)
 
 # ########################################################################### #
 # MAIN                                                                        #
 # ########################################################################### #
 
+def create_sink(spec, name, index = 0, fps = None):
+    """ Create an OCVSink from a command line spec
+        - window, none, images:DIR, video:DIR or mjpeg:[HOST:]PORT (window 'index' is added to PORT)
+        - MJPEG is served on MJPEG_HOST (localhost) unless HOST is given
+        - Videos are written at VIDEO_FPS unless 'fps' is given
+    """
+    kind, _, arg = spec.partition(":")
+    if kind == "none":
+        return OCVNullSink(fps)
+    elif kind == "images":
+        return OCVImageSequenceSink(os.path.join(arg or ".", name + "-%06d.jpg"), fps)
+    elif kind == "video":
+        return OCVVideoSink(os.path.join(arg or ".", name + ".avi"), fps or VIDEO_FPS)
+    elif kind == "mjpeg":
+        host, _, port = arg.rpartition(":")
+        return OCVMJPEGSink(int(port or MJPEG_PORT) + index, fps, host=host or MJPEG_HOST)
+    return OCVHighGUISink(fps)
+
 if __name__ == "__main__":
     cap_id      = DEFAULT_DEV
     cap_width   = DEFAULT_DEV_WIDTH
     cap_height  = DEFAULT_DEV_HEIGHT
+    cap_buffer  = CAPTURE_BUFFER
+    cap_mode    = CAPTURE_MODE
 
     parser = argparse.ArgumentParser(description='PyOCV Example Help')
     parser.add_argument('--device', action='store', type=int,
@@ -209,6 +490,26 @@ if __name__ == "__main__":
                        help='the capture width in pixels (default: %d)' % cap_width)
     parser.add_argument('--height', action='store', type=int,
                        help='the capture height in pixels (default: %d)' % cap_height)
+    parser.add_argument('--buffer', action='store', type=int,
+                       help='grab frames in a background thread with a ring of this many frames (default: %d)' % cap_buffer)
+    parser.add_argument('--every', action='store_true',
+                       help='process every buffered frame instead of only the latest one')
+    parser.add_argument('--sink', action='store', default='window',
+                       help='where to render: window, none, images:DIR, video:DIR or mjpeg:[HOST:]PORT, HOST defaults to %s (default: window)' % MJPEG_HOST)
+    parser.add_argument('--sink-fps', action='store', type=float, default=None,
+                       help='render at most this many frames per second')
+    parser.add_argument('--fps', action='store', type=float, default=None,
+                       help='lower quality as needed to hold this frame rate (try %d)' % QUALITY_FPS)
+    parser.add_argument('--haars', action='store', default=None,
+                       help='comma separated cascades (index or name) to detect at once with the a key')
+    parser.add_argument('--nested', action='append', default=[],
+                       help='only search CHILD inside PARENT objects, given as CHILD:PARENT (can be repeated)')
+    parser.add_argument('--bus', action='store', default=None,
+                       help='publish captured frames on a shared memory frame bus of this name (see batch.py --bus)')
+    parser.add_argument('--profile', action='store_true',
+                       help='collect per-stage timings')
+    parser.add_argument('--profile-dump', action='store', default=None,
+                       help='write timings to this file on exit (Prometheus text if it ends with .prom, JSON otherwise)')
 
     args = parser.parse_args()
     try:
@@ -226,17 +527,48 @@ if __name__ == "__main__":
     except:
         pass
 
-    app = Tracker(DEFAULT_TMP, cap_id, cap_width, cap_height)
+    if args.buffer is not None:
+        cap_buffer = args.buffer
+
+    if args.every:
+        cap_mode = OCVCaptureReader.EVERY
+
+    sinks = (create_sink(args.sink, "results", 1, args.sink_fps),
+             create_sink(args.sink, "settings", 0, args.sink_fps))
+
+    cascades = None
+    if args.haars:
+        cascade  = lambda h: int(h) if h.isdigit() else h
+        haars    = [cascade(h) for h in args.haars.split(",") if h]
+        nested   = dict([[cascade(h) for h in n.split(":", 1)] for n in args.nested])
+        cascades = OCVMultiDetector(haars, nested)
+
+    app = Tracker(cap_id, cap_width, cap_height, cap_buffer, cap_mode, sinks, args.fps, cascades, args.bus)
     print """PyOCV Example
 
 Press q - To quit
-      c - Capture Text
+      c - Capture Text (in the background)
       f - Capture Object
+      a - Capture Objects of all cascades (see --haars)
+      o - Toggle Object Tracking (On/Off)
+      g - Toggle Motion Gated Detection (On/Off)
+      s - Toggle Scene Gate, reuse results of unchanged scenes (On/Off)
       t - Toggle Preview Mode (Capture/Histogram)
+      p - Toggle Profile Overlay (On/Off)
       m - Toggle Image Modification (On/Off)
       b - Toggle B&W (Type/Threshold/Equalize)
 
 """
 
+    if args.profile or args.profile_dump:
+        OCVStats.enabled = True
+
     app.run()
 
+    if args.profile_dump:
+        with open(args.profile_dump, "w") as f:
+            if args.profile_dump.endswith(".prom"):
+                f.write(OCVStats.prometheus())
+            else:
+                f.write(OCVStats.json())
+
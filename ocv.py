@@ -9,10 +9,36 @@
 
 import cv
 import os
+import json
+import mmap
+import time
+import struct
+import Queue
+import shelve
+import socket
+import resource
 import subprocess
+import heapq
+import threading
+import multiprocessing
+import multiprocessing.pool
+import SocketServer
+import BaseHTTPServer
+
+from collections import OrderedDict, deque
 
 from config import *
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 # ########################################################################### #
 # MISC                                                                        #
 # ########################################################################### #
@@ -40,85 +66,551 @@ OCVCaptureProperties = {
     #cv.CV_CAP_PROP_RECTIFICATION
 }
 
+#
+# Class: OCVProfiler -- Per-stage Timing
+#
+class OCVProfiler:
+
+    def __init__(self, enabled = PROFILE_ENABLED, window = PROFILE_WINDOW):
+        """ Collect timings of named stages and loop iterations
+            - Percentiles and FPS are computed over the last 'window' samples
+            - When disabled, stage() and profile() cost a single attribute check
+        """
+        self.enabled  = enabled
+        self.window   = window
+        self.stages   = OrderedDict()
+        self.counts   = {}
+        self.sums     = {}
+        self.ticks    = deque(maxlen=window)
+        self.dropped  = 0
+        self.lock     = threading.Lock()
+        self.null     = OCVNullTimer()
+
+    def stage(self, name):
+        """Get a context manager timing the 'name' stage"""
+        if not self.enabled:
+            return self.null
+        return OCVTimer(self, name)
+
+    def profile(self, name = None):
+        """Get a decorator timing every call of a function as the 'name' stage"""
+        def decorator(fn):
+            label = name or fn.__name__
+
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+
+                start = time.time()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(label, time.time() - start)
+
+            wrapper.__name__ = fn.__name__
+            wrapper.__doc__  = fn.__doc__
+            return wrapper
+
+        return decorator
+
+    def record(self, name, seconds):
+        """Add a timing sample"""
+        with self.lock:
+            if name not in self.stages:
+                self.stages[name] = deque(maxlen=self.window)
+                self.counts[name] = 0
+                self.sums[name]   = 0.
+            self.stages[name].append(seconds)
+            self.counts[name] += 1
+            self.sums[name]   += seconds
+
+    def tick(self, dropped = None):
+        """Mark the end of a loop iteration ('dropped' is the total number of dropped frames)"""
+        if self.enabled:
+            self.ticks.append(time.time())
+            if dropped is not None:
+                self.dropped = dropped
+
+    def fps(self):
+        """Get the loop rate"""
+        if len(self.ticks) < 2 or self.ticks[-1] == self.ticks[0]:
+            return 0.
+        return (len(self.ticks) - 1) / (self.ticks[-1] - self.ticks[0])
+
+    def report(self):
+        """Get FPS, dropped frames and p50/p95/p99 (in ms), count and total seconds of every stage"""
+        stages = OrderedDict()
+        with self.lock:
+            for name, samples in self.stages.items():
+                values = sorted(samples)
+                stages[name] = {"count": self.counts[name], "sum": self.sums[name]}
+                for p in (50, 95, 99):
+                    stages[name]["p%d" % p] = values[min(len(values) - 1, len(values) * p / 100)] * 1000.
+
+        return {
+            "fps"     : self.fps(),
+            "dropped" : self.dropped,
+            "stages"  : stages
+        }
+
+    def json(self):
+        """Get the report as JSON"""
+        return json.dumps(self.report())
+
+    def prometheus(self):
+        """Get the report in the Prometheus text format"""
+        report = self.report()
+        lines  = [
+            "# TYPE pyocv_fps gauge",
+            "pyocv_fps %f" % report["fps"],
+            "# TYPE pyocv_dropped_frames_total counter",
+            "pyocv_dropped_frames_total %d" % report["dropped"],
+            "# TYPE pyocv_stage_seconds summary"
+        ]
+
+        for name, stage in report["stages"].items():
+            for p in (50, 95, 99):
+                lines.append('pyocv_stage_seconds{stage="%s",quantile="0.%d"} %f' % (name, p, stage["p%d" % p] / 1000.))
+            lines.append('pyocv_stage_seconds_sum{stage="%s"} %f' % (name, stage["sum"]))
+            lines.append('pyocv_stage_seconds_count{stage="%s"} %d' % (name, stage["count"]))
+
+        return "\n".join(lines) + "\n"
+
+    def overlay(self, frame, font = None, x = 5, y = 12, step = 12):
+        """Draw the report on given frame"""
+        if font is None:
+            font = cv.InitFont(cv.CV_FONT_HERSHEY_PLAIN, 0.8, 0.8, 0, 1, 1)
+
+        report = self.report()
+        lines  = ["%.1f fps, %d dropped" % (report["fps"], report["dropped"])]
+        for name, stage in report["stages"].items():
+            lines.append("%s %.1f/%.1f/%.1f ms" % (name, stage["p50"], stage["p95"], stage["p99"]))
+
+        for line in lines:
+            cv.PutText(frame, line, (x, y), font, cv.ScalarAll(255))
+            y += step
+
+#
+# Class: OCVTimer -- Stage Timer (see OCVProfiler)
+#
+class OCVTimer:
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name     = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *args):
+        self.profiler.record(self.name, time.time() - self.start)
+        return False
+
+#
+# Class: OCVNullTimer -- Disabled Stage Timer
+#
+class OCVNullTimer:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+# Shared profiler
+OCVStats     = OCVProfiler()
+OCVProfile   = OCVStats.profile
+
+#
+# Class: OCVCascadeRegistry -- Loaded HAAR Cascade Cache
+#
+class OCVCascadeRegistry:
+
+    def __init__(self, path = HAAR_PATH, names = HAARS, size = HAAR_CACHE_SIZE):
+        """ Create a new cascade registry
+            - 'names' is the list of cascades that can be referred to by index
+            - At most 'size' loaded cascades are kept (least recently used goes first)
+        """
+        self.path    = path
+        self.names   = names
+        self.size    = size
+        self.cache   = OrderedDict()
+        self.lock    = threading.Lock()
+        self.hits    = 0
+        self.misses  = 0
+
+    def filename(self, haar):
+        """Get the XML path of given cascade (index, name or path)"""
+        if isinstance(haar, int):
+            haar = self.names[haar]
+        if os.path.isfile(haar):
+            return haar
+        return "%s/%s.%s" % (self.path, haar, "xml")
+
+    def get(self, haar):
+        """Get a loaded cascade (index, name or path). Loads it on first use"""
+        path = self.filename(haar)
+
+        with self.lock:
+            cascade = self.cache.pop(path, None)
+            if cascade is not None:
+                self.hits += 1
+                self.cache[path] = cascade
+                return cascade
+            self.misses += 1
+
+        # Loading is slow, lookups of other cascades must not wait for it
+        loaded = cv.Load(path)
+
+        with self.lock:
+            # Another thread may have loaded it meanwhile, keep the first one
+            cascade = self.cache.setdefault(path, loaded)
+            while len(self.cache) > self.size:
+                self.cache.popitem(False)
+
+        return cascade
+
+    def warm(self, haars, background = True):
+        """Pre-load given cascades (in a background thread by default)"""
+        def load():
+            for haar in haars:
+                try:
+                    self.get(haar)
+                except:
+                    print "Failed to load cascade: %s" % haar
+
+        if background:
+            thread = threading.Thread(target=load, name="OCVCascadeWarmup")
+            thread.daemon = True
+            thread.start()
+            return thread
+
+        load()
+        return None
+
+    def clear(self):
+        """Remove all loaded cascades"""
+        with self.lock:
+            self.cache.clear()
+
+    def stats(self):
+        """Get cache statistics"""
+        return {
+            "size"    : len(self.cache),
+            "hits"    : self.hits,
+            "misses"  : self.misses
+        }
+
+# Shared cascade registry
+OCVCascades = OCVCascadeRegistry()
+
+#
+# Class: OCVFramePool -- Reusable Frame Buffers
+#
+class OCVFramePool:
+
+    def __init__(self, limit = FRAME_POOL_LIMIT, size = FRAME_POOL_BYTES, owned = FRAME_POOL_OWNED):
+        """ Create a new frame pool
+            - Frames are keyed by (size, depth, channels)
+            - At most 'limit' free frames are kept per key and 'size' bytes in total,
+              the least recently used keys are evicted first
+            - At most 'owned' checked out frames are tracked. Older ones are forgotten
+              (release() ignores them), so frames callers drop are freed
+        """
+        self.limit      = limit
+        self.size       = size
+        self.max_owned  = owned
+        self.free       = OrderedDict()
+        self.owned      = OrderedDict()
+        self.bytes      = 0
+        self.lock       = threading.Lock()
+        self.allocated  = 0
+        self.last       = 0
+        self.total      = 0
+        self.evicted    = 0
+
+    def acquire(self, size, depth = cv.IPL_DEPTH_8U, channels = 3):
+        """Get a frame (contents are undefined)"""
+        key = (tuple(size), depth, channels)
+
+        with self.lock:
+            frames = self.free.pop(key, None)
+            if frames:
+                img = frames.pop()
+                self.bytes -= img.height * img.widthStep
+                if frames:
+                    self.free[key] = frames
+            else:
+                img = cv.CreateImage(size, depth, channels)
+                self.allocated += 1
+                self.total     += 1
+
+            self.owned[id(img)] = img
+            while len(self.owned) > self.max_owned:
+                self.owned.popitem(False)
+
+        return img
+
+    def release(self, frame):
+        """Give a frame back. Frames not (or no longer) checked out from the pool are ignored"""
+        if frame is None:
+            return False
+
+        with self.lock:
+            if self.owned.get(id(frame)) is not frame:
+                return False
+            del self.owned[id(frame)]
+
+            key    = ((frame.width, frame.height), frame.depth, frame.nChannels)
+            frames = self.free.pop(key, [])
+            nbytes = frame.height * frame.widthStep
+            if len(frames) < self.limit and nbytes <= self.size:
+                frames.append(frame)
+                self.bytes += nbytes
+            if frames:
+                self.free[key] = frames
+
+            # Evict the least recently used keys
+            while self.bytes > self.size:
+                key, frames = self.free.popitem(False)
+                for f in frames:
+                    self.bytes -= f.height * f.widthStep
+                    self.evicted += 1
+
+        return True
+
+    def reuse(self, frame, size, depth = cv.IPL_DEPTH_8U, channels = 3):
+        """Get 'frame' back if it matches given properties, otherwise swap it for one that does"""
+        if frame is not None:
+            if (frame.width, frame.height) == tuple(size) and frame.depth == depth and frame.nChannels == channels:
+                return frame
+            self.release(frame)
+
+        return self.acquire(size, depth, channels)
+
+    def tick(self):
+        """Mark the end of a frame. Returns the number of allocations made during it"""
+        with self.lock:
+            self.last      = self.allocated
+            self.allocated = 0
+            return self.last
+
+    def stats(self):
+        """Get pool statistics"""
+        with self.lock:
+            return {
+                "frame"   : self.last,
+                "total"   : self.total,
+                "owned"   : len(self.owned),
+                "free"    : sum([len(f) for f in self.free.values()]),
+                "bytes"   : self.bytes,
+                "evicted" : self.evicted
+            }
+
+# Shared frame pool
+OCVFrames = OCVFramePool()
+
+#
+# Class: OCVStoragePool -- Per-Thread Scratch MemStorage
+#
+class OCVStoragePool:
+
+    def __init__(self):
+        """ Hands out one MemStorage per thread
+            - Use scope() so the storage is cleared when the results have been copied out
+        """
+        self.local   = threading.local()
+        self.lock    = threading.Lock()
+        self.created = 0
+        self.scopes  = 0
+
+    def get(self):
+        """Get the storage of the calling thread"""
+        storage = getattr(self.local, "storage", None)
+        if storage is None:
+            storage = self.local.storage = cv.CreateMemStorage(0)
+            with self.lock:
+                self.created += 1
+        return storage
+
+    def scope(self, storage = None):
+        """Get a context manager giving 'storage' (or the thread storage) and clearing it afterwards"""
+        if storage is None:
+            storage = self.get()
+        return OCVStorageScope(self, storage)
+
+    def stats(self):
+        """Get pool statistics"""
+        with self.lock:
+            return {
+                "storages" : self.created,
+                "scopes"   : self.scopes
+            }
+
+#
+# Class: OCVStorageScope -- Cleared MemStorage (see OCVStoragePool)
+#
+class OCVStorageScope:
+
+    def __init__(self, pool, storage):
+        self.pool    = pool
+        self.storage = storage
+
+    def __enter__(self):
+        return self.storage
+
+    def __exit__(self, *args):
+        cv.ClearMemStorage(self.storage)
+        with self.pool.lock:
+            self.pool.scopes += 1
+        return False
+
+# Shared storage pool
+OCVStorages = OCVStoragePool()
+
+#
+# Class: OCVMemoryMonitor -- Resident Memory Accounting
+#
+class OCVMemoryMonitor:
+
+    def __init__(self, interval = MEMORY_INTERVAL, growth = MEMORY_GROWTH):
+        """ Sample the resident size every 'interval' ticks
+            - tick() reports when the high-water mark grows more than 'growth' (0..1) past the last report
+        """
+        self.interval = interval
+        self.growth   = growth
+        self.ticks    = 0
+        self.baseline = None
+        self.rss      = 0
+        self.high     = 0
+        self.reported = 0
+
+    def sample(self):
+        """Get the current resident size in KiB"""
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * (resource.getpagesize() / 1024)
+        except (IOError, OSError, ValueError, IndexError):
+            return self.peak()
+
+    def peak(self):
+        """Get the peak resident size of the process in KiB"""
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    def tick(self):
+        """ Mark the end of a frame
+            - Returns True when a new high-water mark worth reporting was reached
+        """
+        self.ticks += 1
+        if self.baseline is not None and self.ticks % self.interval:
+            return False
+
+        self.rss  = self.sample()
+        self.high = max(self.high, self.rss)
+        if self.baseline is None:
+            self.baseline = self.reported = self.rss
+            return False
+
+        if self.high > self.reported * (1. + self.growth):
+            self.reported = self.high
+            return True
+
+        return False
+
+    def stats(self):
+        """Get memory statistics in KiB"""
+        return {
+            "rss"      : self.rss,
+            "high"     : self.high,
+            "peak"     : self.peak(),
+            "baseline" : self.baseline or 0,
+            "growth"   : self.high - (self.baseline or 0)
+        }
+
 # ########################################################################### #
 # FUNCTIONS                                                                   #
 # ########################################################################### #
 
 def OCVPILImage(src):
-    """Create OpenCV frame from a PIL source"""
-    pi = Image.open(src)
-    cv_im = cv.CreateImageHeader(pi.size, cv.IPL_DEPTH_8U, 1)
-    cv.SetData(cv_im, pi.tostring())
+    """ Create OpenCV frame from a PIL source (filename, file object or PIL image)
+        - Grayscale images give a 1-channel frame, everything else a BGR frame
+    """
+    pi = src if hasattr(src, "mode") else Image.open(src)
+
+    if pi.mode not in ("L", "RGB", "RGBA"):
+        pi = pi.convert("RGBA" if "A" in pi.mode else "RGB")
+
+    channels = len(pi.mode)
+    data     = pi.tobytes() if hasattr(pi, "tobytes") else pi.tostring()
+
+    header = cv.CreateImageHeader(pi.size, cv.IPL_DEPTH_8U, channels)
+    cv.SetData(header, data, pi.size[0] * channels)
+    if channels == 1:
+        return header
+
+    cv_im = cv.CreateImage(pi.size, cv.IPL_DEPTH_8U, 3)
+    cv.CvtColor(header, cv_im, cv.CV_RGB2BGR if channels == 3 else cv.CV_RGBA2BGR)
     return cv_im
 
 def OCVNumpyArray(im):
-  """Get Numpy array from OpenCV frame"""
-  depth2dtype = {
-        cv.IPL_DEPTH_8U: 'uint8',
-        cv.IPL_DEPTH_8S: 'int8',
-        cv.IPL_DEPTH_16U: 'uint16',
-        cv.IPL_DEPTH_16S: 'int16',
-        cv.IPL_DEPTH_32S: 'int32',
-        cv.IPL_DEPTH_32F: 'float32',
-        cv.IPL_DEPTH_64F: 'float64',
-    }
-
-  arrdtype=im.depth
-  a = np.fromstring(
-         im.tostring(),
-         dtype=depth2dtype[im.depth],
-         count=im.width*im.height*im.nChannels)
-  a.shape = (im.height,im.width,im.nChannels)
-  return a
+    """ Get Numpy array from OpenCV frame (or matrix)
+        - The array shares memory with the frame, nothing is copied
+        - Sub-rects (cv.GetSubRect) give a strided view of the parent
+        - The shape is always (height, width, channels)
+    """
+    if hasattr(im, "nChannels"):
+        im = cv.GetMat(im)
+
+    a = np.asarray(im)
+    if a.ndim == 2:
+        a = a[:, :, np.newaxis]
+    return a
 
 def OCVNumpyImage(a):
-    """Get the OpenCV frame from Numpy array"""
-    dtype2depth = {
-        'uint8':   cv.IPL_DEPTH_8U,
-        'int8':    cv.IPL_DEPTH_8S,
-        'uint16':  cv.IPL_DEPTH_16U,
-        'int16':   cv.IPL_DEPTH_16S,
-        'int32':   cv.IPL_DEPTH_32S,
-        'float32': cv.IPL_DEPTH_32F,
-        'float64': cv.IPL_DEPTH_64F,
-    }
-    try:
-        nChannels = a.shape[2]
-    except:
-        nChannels = 1
-
-    cv_im = cv.CreateImageHeader((a.shape[1],a.shape[0]),
-                dtype2depth[str(a.dtype)],
-                nChannels)
-    cv.SetData(cv_im, a.tostring(), a.dtype.itemsize*nChannels*a.shape[1])
-    return cv_im
+    """ Get the OpenCV frame from Numpy array
+        - The frame shares memory with the array when rows are contiguous
+        - Otherwise the array is compacted first (one copy)
+    """
+    if a.ndim == 3 and a.shape[2] == 1:
+        a = a[:, :, 0]
+
+    pixel = a.itemsize
+    if a.ndim == 3:
+        pixel *= a.shape[2]
 
-def OCVHistogram(frame, ranges = [[0, 256]], hist_size = 64):
-    """Create a histogram of given frame"""
+    if a.strides[-1] != a.itemsize or a.strides[1] != pixel or a.strides[0] < pixel * a.shape[1]:
+        a = np.ascontiguousarray(a)
+
+    return cv.GetImage(cv.fromarray(a))
+
+@OCVProfile("histogram")
+def OCVHistogram(frame, ranges = [[0, 256]], hist_size = 64, dst = None):
+    """ Create a histogram of given frame (drawn into 'dst' if given)
+        - Black bars on white, drawn by a shared OCVHistogramEngine per bin layout
+    """
     if frame.nChannels != 1:
         dest = OCVCopyGrayscale(frame)
     else:
         dest = frame
 
-    hist_image = cv.CreateImage((dest.width, dest.height), 8, 1)
-    hist = cv.CreateHist([hist_size], cv.CV_HIST_ARRAY, ranges, 1)
+    if dst is None:
+        dst = OCVFrames.acquire((dest.width, dest.height), 8, 1)
 
-    cv.CalcArrHist([dest], hist)
-    (min_value, max_value, _, _) = cv.GetMinMaxHistValue(hist)
-    cv.Scale(hist.bins, hist.bins, float(hist_image.height) / max_value, 0)
+    key = (hist_size, tuple([tuple(r) for r in ranges]))
+    with OCVHistogramsLock:
+        engine = OCVHistograms.get(key)
+        if engine is None:
+            engine = OCVHistograms[key] = OCVHistogramEngine(hist_size, ranges=ranges)
 
-    cv.Set(hist_image, cv.ScalarAll(255))
-    bin_w = round(float(hist_image.width) / hist_size)
+    engine.render(dest, dst)
+    if dest is not frame:
+        OCVFrames.release(dest)
 
-    for i in range(hist_size):
-        cv.Rectangle(hist_image, (int(i * bin_w), hist_image.height),
-            (int((i + 1) * bin_w), hist_image.height - cv.Round(hist.bins[i])),
-            cv.ScalarAll(0), -1, 8, 0)
+    return dst
 
-    return hist_image
-
-def OCVBrightnessContrast(frame, contrast, brightness):
-    """ Set brightness / contrast of given frame. Values from 0 to 200
+def OCVBrightnessContrastScale(contrast, brightness):
+    """ Get the (scale, offset) pair for given brightness / contrast. Values from 0 to 200
 
         The algorithm is by Werner D. Streidt
         (http://visca.com/ffactory/archives/5-99/msg00021.html)
@@ -132,23 +624,38 @@ def OCVBrightnessContrast(frame, contrast, brightness):
         a     = (256. - delta * 2) / 255
         b     = a * brightness + delta
 
+    return (a, b)
+
+@OCVProfile("brightness_contrast")
+def OCVBrightnessContrast(frame, contrast, brightness):
+    """Set brightness / contrast of given frame. Values from 0 to 200"""
+    a, b = OCVBrightnessContrastScale(contrast, brightness)
     cv.ConvertScale(frame, frame, a, b)
 
-def OCVCloneImage(frame):
-    """Clone and return given frame"""
-    img = cv.CreateImage((frame.width, frame.height), frame.depth, frame.nChannels)
+@OCVProfile("clone")
+def OCVCloneImage(frame, dst = None):
+    """Clone and return given frame (into 'dst' if given)"""
+    img = dst
+    if img is None:
+        img = OCVFrames.acquire((frame.width, frame.height), frame.depth, frame.nChannels)
     cv.Copy(frame, img)
     return img
 
-def OCVResizeImage(frame, size):
-    """Clone, resize and return given frame"""
-    img = cv.CreateImage(size, frame.depth, frame.nChannels)
+@OCVProfile("resize")
+def OCVResizeImage(frame, size, dst = None):
+    """Clone, resize and return given frame (into 'dst' if given)"""
+    img = dst
+    if img is None:
+        img = OCVFrames.acquire(size, frame.depth, frame.nChannels)
     cv.Resize(frame, img)
     return img
 
-def OCVCopyGrayscale(frame):
-    """Copy frame and convert to GrayScale"""
-    img = cv.CreateImage((frame.width, frame.height), frame.depth, 1)
+@OCVProfile("grayscale")
+def OCVCopyGrayscale(frame, dst = None):
+    """Copy frame and convert to GrayScale (into 'dst' if given)"""
+    img = dst
+    if img is None:
+        img = OCVFrames.acquire((frame.width, frame.height), frame.depth, 1)
     cv.CvtColor(frame, img, cv.CV_RGB2GRAY)
     return img
 
@@ -156,15 +663,25 @@ def OCVClear(frame, color = (0, 0, 0)):
     """Clear a Frame"""
     cv.Set(frame, color);
 
-def OCVObjects(frame, storage, haar):
-    """Read Objects from Frame"""
-    cascade = cv.Load(haar)
-    objects = cv.HaarDetectObjects(frame, cascade, storage, 1.2, 2, 0, (20, 20))
+@OCVProfile("objects")
+def OCVObjects(frame, storage, haar, scale_factor = HAAR_SCALE_FACTOR, scale = HAAR_SCALE,
+               min_neighbors = HAAR_NEIGHBORS, flags = HAAR_FLAGS, min_size = HAAR_MIN_SIZE, max_size = HAAR_MAX_SIZE):
+    """ Read Objects from Frame ('haar' is a cascade index, name, path or loaded cascade)
+        - 'storage' is scratch space and cleared afterwards (None uses the thread storage, see OCVStorages)
+        - With a 'scale' below 1.0 a downscaled copy is searched, rectangles are in frame coordinates
+        - See OCVDetector for the other parameters
+    """
+    detector = OCVDetector(scale, scale_factor, min_neighbors, flags, min_size, max_size)
+    objects  = detector.detect(frame, haar, storage)
+    detector.release()
     return objects
 
-def OCVText(frame, text, x = 0, y = 0, step = 15, font = None, clear = False):
-    """Apply text to an image"""
-    img = cv.CreateImage((frame.width, frame.height), frame.depth, frame.nChannels)
+@OCVProfile("draw_text")
+def OCVText(frame, text, x = 0, y = 0, step = 15, font = None, clear = False, dst = None):
+    """Apply text to an image (into 'dst' if given)"""
+    img = dst
+    if img is None:
+        img = OCVFrames.acquire((frame.width, frame.height), frame.depth, frame.nChannels)
 
     if font is None:
         font = cv.InitFont(cv.CV_FONT_HERSHEY_PLAIN, 0.9, 0.9, 0, 1, 1)
@@ -180,18 +697,49 @@ def OCVText(frame, text, x = 0, y = 0, step = 15, font = None, clear = False):
 
     return img
 
-def OCVReadText(frame, name, out, psm = 3, lang = None):
-    """Read Text From Image"""
+def OCVTesseractArgs(name, out, psm = 3, lang = None):
+    """Get the Tesseract command line for given image and output base"""
+    args = [TESSERACT_BIN, str(name), str(out)]
+    if lang is not None:
+        args.append("-l")
+        args.append(lang)
+
+    args.append("-psm")
+    args.append(str(psm))
+    return args
+
+def OCVReadText(frame, name = None, out = None, psm = 3, lang = None, timeout = None, cache = None):
+    """ Read Text From Image
+        - Uses the shared Tesseract worker pool unless 'name' and 'out' paths are given
+        - Results are looked up in / stored to the given OCVTextCache
+        - Lookups are timed as the "ocr_cache" stage, Tesseract runs as "ocr"
+    """
+    if cache is None:
+        return OCVTesseractRead(frame, name, out, psm, lang, timeout)
+
+    with OCVStats.stage("ocr_cache"):
+        key = cache.hash(frame)
+        hit, data = cache.get(key, psm, lang)
+    if hit:
+        return data
+
+    data = OCVTesseractRead(frame, name, out, psm, lang, timeout)
+    cache.put(key, psm, lang, data)
+    return data
+
+@OCVProfile("ocr")
+def OCVTesseractRead(frame, name = None, out = None, psm = 3, lang = None, timeout = None):
+    """Run Tesseract on a frame (see OCVReadText)"""
+    if name is None or out is None:
+        return OCVTesseractEngine().read(frame, psm, lang, timeout)
+
     data = None
 
     # Save image
     cv.SaveImage(name, frame);
     if os.path.isfile(name):
         # Detect text
-        args = [TESSERACT_BIN, '-psm', str(psm), str(name), str(out)]
-        if lang is not None:
-            args.append("-lang")
-            args.append(lang)
+        args = OCVTesseractArgs(name, out, psm, lang)
 
         print "Executing: %s" % (((" ").join(args)))
         cmdout = subprocess.Popen(args, stderr=subprocess.STDOUT, stdout=subprocess.PIPE).communicate()[0]
@@ -203,6 +751,63 @@ def OCVReadText(frame, name, out, psm = 3, lang = None):
 
     return data
 
+def OCVTextRegions(frame, storage = None, min_size = TEXT_REGION_SIZE, fill = TEXT_REGION_FILL, join = TEXT_REGION_JOIN):
+    """ Find candidate text regions (x, y, w, h) in given frame
+        - Morphological gradient, Otsu threshold and a horizontal closing joining
+          characters less than 'join' pixels apart, then contour analysis
+        - Regions smaller than 'min_size' (w, h) or with less than 'fill' (0..1) edge pixels are dropped
+        - 'storage' is scratch space and cleared afterwards (None uses the thread storage, see OCVStorages)
+    """
+    size = (frame.width, frame.height)
+    if frame.nChannels != 1:
+        gray = OCVCopyGrayscale(frame)
+    else:
+        gray = frame
+
+    grad = OCVFrames.acquire(size, cv.IPL_DEPTH_8U, 1)
+    bw   = OCVFrames.acquire(size, cv.IPL_DEPTH_8U, 1)
+    tmp  = OCVFrames.acquire(size, cv.IPL_DEPTH_8U, 1)
+
+    ellipse = cv.CreateStructuringElementEx(3, 3, 1, 1, cv.CV_SHAPE_ELLIPSE)
+    line    = cv.CreateStructuringElementEx(join, 1, join / 2, 0, cv.CV_SHAPE_RECT)
+
+    cv.MorphologyEx(gray, grad, tmp, ellipse, cv.CV_MOP_GRADIENT)
+    cv.Threshold(grad, grad, 0, 255, cv.CV_THRESH_BINARY | cv.CV_THRESH_OTSU)
+    cv.MorphologyEx(grad, bw, tmp, line, cv.CV_MOP_CLOSE)
+
+    regions  = []
+    with OCVStorages.scope(storage) as storage:
+        contours = cv.FindContours(bw, storage, cv.CV_RETR_EXTERNAL, cv.CV_CHAIN_APPROX_SIMPLE)
+        while contours:
+            (x, y, w, h) = cv.BoundingRect(contours)
+            contours = contours.h_next()
+
+            if w < min_size[0] or h < min_size[1] or w < h:
+                continue
+            if cv.CountNonZero(cv.GetSubRect(grad, (x, y, w, h))) < fill * w * h:
+                continue
+            regions.append((x, y, w, h))
+
+    for f in (grad, bw, tmp):
+        OCVFrames.release(f)
+    if gray is not frame:
+        OCVFrames.release(gray)
+
+    return regions
+
+def OCVTesseractEngine():
+    """Get the shared Tesseract worker pool (one per process)"""
+    global _tesseract
+
+    with _tesseract_lock:
+        if _tesseract is None or _tesseract.pid != os.getpid():
+            _tesseract = OCVTesseractPool()
+
+    return _tesseract
+
+_tesseract      = None
+_tesseract_lock = threading.Lock()
+
 # ########################################################################### #
 # CLASSES                                                                     #
 # ########################################################################### #
@@ -212,32 +817,827 @@ def OCVReadText(frame, name, out, psm = 3, lang = None):
 #
 class OCVApplication:
 
-    def __init__(self, id = 0, cap=None, width=None, height=None):
-        """Create a new OpenCV Application"""
+    def __init__(self, id = 0, cap=None, width=None, height=None, haars=None, buffer=CAPTURE_BUFFER, mode=CAPTURE_MODE, sources=None, pipeline=None):
+        """ Create a new OpenCV Application
+            - 'haars' is a list of cascades to pre-load in the background
+            - If 'buffer' is set frames are grabbed in a background thread (see OCVCaptureReader)
+            - 'sources' is a list of device ids / video files, each processed by
+              'pipeline' in its own process (see OCVSourcePool and events())
+        """
         self.storage      = cv.CreateMemStorage(id)
         self.font         = cv.InitFont(cv.CV_FONT_HERSHEY_PLAIN, 0.9, 0.9, 0, 1, 1)
+        self.capture      = None
+        self.sources      = None
+
+        if haars:
+            OCVCascades.warm(haars)
+
+        if sources:
+            self.sources = OCVSourcePool(sources, pipeline, width, height)
 
         # Initialize capture device, if given
         if cap is not None and isinstance(cap, int):
             self.capture = OCVCapture(cap, width, height)
+            if buffer:
+                self.capture.start(buffer, mode)
 
     def run(self, flip = False, delay = 10):
-        """Application Main Loop"""
+        """ Application Main Loop
+            - The key wait is timed as the "wait_key" stage, getting the frame as "capture"
+        """
         if self.capture:
-            key   = cv.WaitKey(delay)
-            frame = self.capture.poll(flip)
+            with OCVStats.stage("wait_key"):
+                key = cv.WaitKey(delay)
+            with OCVStats.stage("capture"):
+                frame = self.capture.poll(flip)
 
             return (frame, key)
 
         return False
 
+    def events(self, latency = SOURCE_LATENCY):
+        """Get merged results of all sources (see OCVSourcePool.events())"""
+        if self.sources is None:
+            return iter([])
+        return self.sources.events(latency)
+
     def stop(self):
         """Stop Application (Run when finished)"""
+        if self.capture:
+            self.capture.stop()
+
+        if self.sources:
+            self.sources.stop()
+
         try:
             cv.ClearMemStorage(self.storage)
         except:
             pass
 
+#
+# Class: OCVFuture -- Result of an asynchronous request
+#
+class OCVFuture:
+
+    def __init__(self):
+        """Create a new pending result"""
+        self.event  = threading.Event()
+        self.lock   = threading.Lock()
+        self.state  = "queued"
+        self.value  = None
+        self.error  = None
+        self.frame  = None
+
+    def start(self):
+        """Mark as running. Returns False if the request was cancelled"""
+        with self.lock:
+            if self.state != "queued":
+                return False
+            self.state = "running"
+            return True
+
+    def finish(self, value = None, error = None):
+        """Store the result and wake up waiters"""
+        with self.lock:
+            self.state = "done"
+            self.value = value
+            self.error = error
+        self.event.set()
+
+    def cancel(self):
+        """Cancel the request if it has not started yet"""
+        with self.lock:
+            if self.state != "queued":
+                return False
+            self.state = "cancelled"
+        self.event.set()
+        OCVFrames.release(self.detach())
+        return True
+
+    def detach(self):
+        """Take the pool frame held by the request (None if already taken)"""
+        with self.lock:
+            frame, self.frame = self.frame, None
+        return frame
+
+    def cancelled(self):
+        """Check if the request was cancelled"""
+        return self.state == "cancelled"
+
+    def running(self):
+        """Check if the request is being processed"""
+        return self.state == "running"
+
+    def done(self):
+        """Check if the request is finished (or cancelled)"""
+        return self.event.is_set()
+
+    def result(self, timeout = None):
+        """Wait for and return the result (None on timeout or cancel)"""
+        if not self.event.wait(timeout):
+            return None
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+#
+# Class: OCVTesseractPool -- Tesseract Worker Pool
+#
+class OCVTesseractPool:
+
+    def __init__(self, size = TESSERACT_POOL_SIZE, timeout = TESSERACT_TIMEOUT, tmp = TESSERACT_TMP):
+        """ Create a pool of OCR workers
+            - Each worker owns a scratch file in 'tmp' (memory backed by default)
+            - Requests running longer than 'timeout' seconds are killed
+        """
+        self.timeout  = timeout
+        self.tmp      = tmp
+        self.pid      = os.getpid()
+        self.queue    = Queue.Queue()
+        self.workers  = []
+
+        for i in range(max(1, size)):
+            worker = threading.Thread(target=self.work, args=(i,), name="OCVTesseract-%d" % i)
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def submit(self, frame, psm = 3, lang = None, timeout = None):
+        """Queue a frame for OCR and return an OCVFuture"""
+        future = OCVFuture()
+        if timeout is None:
+            timeout = self.timeout
+
+        # The caller is free to reuse its frame once we return
+        future.frame = OCVCloneImage(frame)
+        self.queue.put((future, psm, lang, timeout))
+        return future
+
+    def read(self, frame, psm = 3, lang = None, timeout = None):
+        """Read text from frame (blocking)"""
+        return self.submit(frame, psm, lang, timeout).result()
+
+    def close(self):
+        """Stop all workers once the queue is drained"""
+        for worker in self.workers:
+            self.queue.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+    def work(self, index):
+        """Worker loop"""
+        base = os.path.join(self.tmp, "pyocv-%d-%d" % (self.pid, index))
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+
+            future, psm, lang, timeout = item
+            try:
+                # Cancelled while queued (the frame is already back in the pool)
+                if not future.start():
+                    continue
+
+                try:
+                    future.finish(self.run(base, future.frame, psm, lang, timeout))
+                except Exception, e:
+                    future.finish(None, e)
+            finally:
+                OCVFrames.release(future.detach())
+
+    def run(self, base, frame, psm, lang, timeout):
+        """Run Tesseract on a single frame"""
+        name = base + ".bmp"
+        out  = base + ".txt"
+        data = None
+
+        # Uncompressed, so writing it is just a copy into tmpfs
+        cv.SaveImage(name, frame)
+
+        proc  = subprocess.Popen(OCVTesseractArgs(name, base, psm, lang), stderr=subprocess.STDOUT, stdout=subprocess.PIPE)
+        timer = None
+        if timeout:
+            timer = threading.Timer(timeout, proc.kill)
+            timer.start()
+
+        try:
+            proc.communicate()
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        if proc.returncode == 0 and os.path.isfile(out):
+            data = open(out, 'r').read()
+            if not data.strip():
+                data = None
+
+        for path in (name, out):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+        return data
+
+#
+# Class: OCVHistogramEngine -- Reusable Histogram
+#
+class OCVHistogramEngine:
+
+    def __init__(self, hist_size = 64, size = None, ranges = [[0, 256]]):
+        """ Compute and draw histograms of 8-bit frames
+            - All channels are counted in one pass, the bars are drawn in one array operation
+            - The canvas is reused between calls ('size' defaults to the frame size)
+            - Without Numpy, or for other 'ranges' than the full 8-bit one, frames are counted
+              in grayscale by one reused OpenCV histogram and the bars drawn by one comparison
+        """
+        self.hist_size = hist_size
+        self.size      = size
+        self.ranges    = ranges
+        self.lock      = threading.Lock()
+        self.canvas    = None
+        self.bins      = None
+        self.index     = None
+        self.columns   = None
+        self.rows      = None
+        self.hist      = None
+        self.ramp      = None
+        self.heights   = None
+        self.level     = None
+
+        if np is not None and [list(r) for r in ranges] == [[0, 256]]:
+            self.index = (np.arange(256) * hist_size) >> 8
+
+    def compute(self, frame):
+        """Get the bin counts of given frame as a (channels, hist_size) array"""
+        a = OCVNumpyArray(frame)
+        c = a.shape[2]
+
+        idx = self.index[a] + np.arange(c) * self.hist_size
+        self.bins = np.bincount(idx.ravel(), minlength=c * self.hist_size).reshape(c, self.hist_size)
+        return self.bins
+
+    def render(self, frame, dst = None):
+        """ Compute and draw the histogram of given frame
+            - Into 'dst' if given (one channel per frame channel), the engine canvas otherwise
+            - The engine canvas stays owned by the engine
+        """
+        with self.lock:
+            if self.index is None:
+                if dst is None:
+                    self.canvas = OCVFrames.reuse(self.canvas, self.size or (frame.width, frame.height), cv.IPL_DEPTH_8U, 1)
+                    dst = self.canvas
+                return self.draw(frame, dst)
+
+            bins = self.compute(frame)
+            c    = bins.shape[0]
+
+            if dst is None:
+                self.canvas = OCVFrames.reuse(self.canvas, self.size or (frame.width, frame.height), cv.IPL_DEPTH_8U, c)
+                dst = self.canvas
+
+            w, h = dst.width, dst.height
+            if self.columns is None or len(self.columns) != w or len(self.rows) != h:
+                self.columns = np.minimum(np.arange(w) * self.hist_size / w, self.hist_size - 1)
+                self.rows    = np.arange(h)[:, np.newaxis]
+
+            peak    = np.maximum(bins.max(axis=1), 1)[:, np.newaxis]
+            heights = np.round(bins * float(h) / peak).astype(int)[:, self.columns]
+            bars    = self.rows >= (h - heights)[:, np.newaxis, :]
+
+            canvas = OCVNumpyArray(dst)
+            if c == 1:
+                # Black bars on white
+                canvas[:, :, 0] = np.where(bars[0], 0, 255)
+            else:
+                # One color per channel on black
+                canvas[:] = bars.transpose(1, 2, 0) * 255
+
+            return dst
+
+    def draw(self, frame, canvas):
+        """Count frame (in grayscale) with OpenCV and draw black bars on white into 'canvas'"""
+        gray = frame
+        if frame.nChannels != 1:
+            gray = OCVCopyGrayscale(frame)
+
+        if self.hist is None:
+            self.hist = cv.CreateHist([self.hist_size], cv.CV_HIST_ARRAY, self.ranges, 1)
+
+        cv.CalcArrHist([gray], self.hist)
+        if gray is not frame:
+            OCVFrames.release(gray)
+
+        w, h = canvas.width, canvas.height
+        if self.ramp is None or (self.ramp.cols, self.ramp.rows) != (w, h):
+            # Row number of every pixel, built once per canvas size
+            column = cv.CreateMat(h, 1, cv.CV_32FC1)
+            for y in range(h):
+                column[y, 0] = y
+
+            self.ramp    = cv.CreateMat(h, w, cv.CV_32FC1)
+            self.level   = cv.CreateMat(h, w, cv.CV_32FC1)
+            self.heights = cv.CreateMat(1, w, cv.CV_32FC1)
+            cv.Repeat(column, self.ramp)
+
+        (_, peak, _, _) = cv.GetMinMaxHistValue(self.hist)
+        bins = cv.Reshape(cv.GetMat(self.hist.bins, 1), 0, 1)
+
+        # Top of the bar of every column, rows above it stay white
+        cv.Resize(bins, self.heights, cv.CV_INTER_NN)
+        cv.Scale(self.heights, self.heights, -float(h) / max(peak, 1), h)
+        cv.Repeat(self.heights, self.level)
+        cv.Cmp(self.ramp, self.level, canvas, cv.CV_CMP_LT)
+        return canvas
+
+# Engines of OCVHistogram by (hist_size, ranges)
+OCVHistograms     = {}
+OCVHistogramsLock = threading.Lock()
+
+#
+# Class: OCVTextCache -- OCR Result Cache
+#
+class OCVTextCache:
+
+    def __init__(self, distance = TEXT_CACHE_DISTANCE, size = TEXT_CACHE_SIZE, ttl = TEXT_CACHE_TTL, path = TEXT_CACHE_PATH, store_size = TEXT_CACHE_STORE):
+        """ Cache OCR results by a perceptual hash of the (preprocessed) frame
+            - Frames whose 64-bit hashes differ in at most 'distance' bits share a result
+            - At most 'size' results are kept in memory, none older than 'ttl' seconds
+            - With 'path' up to 'store_size' results are also stored on disk (one process at a time)
+            - Failed reads (None) are never cached
+        """
+        self.distance = distance
+        self.size     = size
+        self.ttl      = ttl
+        self.entries  = OrderedDict()
+        self.lock     = threading.Lock()
+        self.thumb    = cv.CreateMat(8, 9, cv.CV_8UC1)
+        self.store    = None
+        self.index    = OrderedDict()
+        self.limit    = store_size
+        self.hits     = 0
+        self.misses   = 0
+        self.disk     = 0
+
+        if path is not None:
+            self.store = shelve.open(path)
+            self.load()
+
+    def load(self):
+        """Index the disk store by key, oldest first, dropping expired entries"""
+        now     = time.time()
+        entries = []
+        for name in self.store.keys():
+            stamp = self.store[name][1]
+            if now - stamp > self.ttl:
+                del self.store[name]
+            else:
+                entries.append((stamp, name))
+
+        for (stamp, name) in sorted(entries):
+            self.index[self.parse(name)] = stamp
+        self.trim()
+
+    def trim(self):
+        """Drop the oldest disk entries over the limit (call with lock held)"""
+        while len(self.index) > self.limit:
+            key, stamp = self.index.popitem(False)
+            del self.store[self.format(key)]
+
+    def close(self):
+        """Flush and close the disk store"""
+        with self.lock:
+            if self.store is not None:
+                self.store.close()
+                self.store = None
+
+    def hash(self, frame):
+        """Get the 64-bit difference hash of given frame"""
+        if frame.nChannels != 1:
+            gray = OCVCopyGrayscale(frame)
+        else:
+            gray = frame
+
+        with self.lock:
+            cv.Resize(gray, self.thumb, cv.CV_INTER_AREA)
+            data = [ord(c) for c in self.thumb.tostring()]
+
+        if gray is not frame:
+            OCVFrames.release(gray)
+
+        h = 0
+        for y in range(8):
+            for x in range(8):
+                h = (h << 1) | (data[y * 9 + x] < data[y * 9 + x + 1])
+        return h
+
+    def get(self, hash, psm = 3, lang = None):
+        """Get a cached result. Returns (found, text)"""
+        now = time.time()
+
+        with self.lock:
+            for key in list(self.entries.keys()):
+                if now - self.entries[key][1] > self.ttl:
+                    del self.entries[key]
+
+            key = self.find(self.entries.keys(), hash, psm, lang)
+            if key is not None:
+                entry = self.entries.pop(key)
+                self.entries[key] = entry
+                self.hits += 1
+                return (True, entry[0])
+
+            if self.store is not None:
+                name = self.find(self.index.keys(), hash, psm, lang)
+                if name is not None:
+                    if now - self.index[name] <= self.ttl:
+                        entry = self.store[self.format(name)]
+                        self.remember(name, entry)
+                        self.hits += 1
+                        self.disk += 1
+                        return (True, entry[0])
+
+                    del self.index[name]
+                    del self.store[self.format(name)]
+
+            self.misses += 1
+            return (False, None)
+
+    def put(self, hash, psm, lang, text):
+        """Store a result (failures, None, are not stored so they are retried)"""
+        if text is None:
+            return
+
+        key   = (hash, psm, lang)
+        entry = (text, time.time())
+
+        with self.lock:
+            self.remember(key, entry)
+            if self.store is not None:
+                self.store[self.format(key)] = entry
+                self.index.pop(key, None)
+                self.index[key] = entry[1]
+                self.trim()
+
+    def remember(self, key, entry):
+        """Put an entry in memory (call with lock held)"""
+        self.entries.pop(key, None)
+        self.entries[key] = entry
+        while len(self.entries) > self.size:
+            self.entries.popitem(False)
+
+    def find(self, keys, hash, psm, lang):
+        """Find the closest key within distance"""
+        best, distance = None, self.distance + 1
+        for key in keys:
+            if key[1] != psm or key[2] != lang:
+                continue
+            d = bin(key[0] ^ hash).count("1")
+            if d < distance:
+                best, distance = key, d
+        return best
+
+    def format(self, key):
+        """Get the disk store name of a key"""
+        return "%016x:%s:%s" % (key[0], key[1], key[2] or "")
+
+    def parse(self, name):
+        """Get the key of a disk store name"""
+        hash, psm, lang = name.split(":", 2)
+        return (int(hash, 16), int(psm), lang or None)
+
+    def stats(self):
+        """Get cache statistics"""
+        return {
+            "size"   : len(self.entries),
+            "hits"   : self.hits,
+            "misses" : self.misses,
+            "disk"   : self.disk,
+            "stored" : len(self.index)
+        }
+
+#
+# Class: OCVTextQueue -- Asynchronous OCR Requests
+#
+class OCVTextQueue:
+
+    COALESCE  = "coalesce"
+    CANCEL    = "cancel"
+
+    def __init__(self, engine = None, pending = TEXT_PENDING, policy = TEXT_POLICY, cache = None):
+        """ Submit OCR requests without waiting for them
+            - At most 'pending' requests wait for a free worker
+            - When full, COALESCE cancels the oldest waiting request, CANCEL refuses the new one
+            - 'engine' defaults to the shared Tesseract pool
+            - With an OCVTextCache, cached frames complete at once
+        """
+        self.engine     = engine
+        self.cache      = cache
+        self.pending    = pending
+        self.policy     = policy
+        self.requests   = []
+        self.submitted  = 0
+        self.completed  = 0
+        self.cancelled  = 0
+        self.refused    = 0
+
+    def submit(self, frame, psm = 3, lang = None, tag = None):
+        """Queue a frame for OCR. Returns the OCVFuture, or None if refused"""
+        key = None
+        if self.cache is not None:
+            key = (self.cache.hash(frame), psm, lang)
+            hit, text = self.cache.get(*key)
+            if hit:
+                future = OCVFuture()
+                future.finish(text)
+                self.requests.append((future, tag, None))
+                self.submitted += 1
+                return future
+
+        queued = [r for r in self.requests if not r[0].running() and not r[0].done()]
+        if len(queued) >= self.pending:
+            if self.policy == self.CANCEL:
+                self.refused += 1
+                return None
+
+            for (future, t, k) in queued[:len(queued) - self.pending + 1]:
+                if future.cancel():
+                    self.cancelled += 1
+
+        engine = self.engine or OCVTesseractEngine()
+        future = engine.submit(frame, psm, lang)
+        self.requests.append((future, tag, key))
+        self.submitted += 1
+        return future
+
+    def poll(self):
+        """Get finished requests as a list of (tag, text) in submission order"""
+        results = []
+        for r in list(self.requests):
+            future, tag, key = r
+            if not future.done():
+                continue
+
+            self.requests.remove(r)
+            if future.cancelled():
+                continue
+
+            try:
+                text = future.result(0)
+            except Exception, e:
+                print "OCR failed: %s" % e
+                text = None
+            else:
+                if key is not None:
+                    self.cache.put(key[0], key[1], key[2], text)
+
+            self.completed += 1
+            results.append((tag, text))
+
+        return results
+
+    def cancel(self):
+        """Cancel all waiting requests"""
+        for (future, tag, key) in self.requests:
+            if future.cancel():
+                self.cancelled += 1
+
+    def stats(self):
+        """Get queue statistics"""
+        running = len([r for r in self.requests if r[0].running()])
+        return {
+            "running"   : running,
+            "queued"    : len([r for r in self.requests if not r[0].done()]) - running,
+            "submitted" : self.submitted,
+            "completed" : self.completed,
+            "cancelled" : self.cancelled,
+            "refused"   : self.refused
+        }
+
+#
+# Class: OCVPointPipeline -- Fused per-pixel operations
+#
+class OCVPointPipeline:
+
+    def __init__(self):
+        """ Compile threshold, equalize and brightness / contrast into one lookup table
+            - The table is only rebuilt when the settings change (see update())
+            - Equalization needs the frame histogram, so it is folded into the table per frame
+        """
+        self.key      = None
+        self.pre      = None
+        self.post     = None
+        self.equalize = False
+        self.lut      = None
+        self.hist     = cv.CreateHist([256], cv.CV_HIST_ARRAY, [[0, 256]], 1)
+        self.builds   = 0
+
+    def update(self, threshold = None, type = None, equalize = False, brightness = 0, contrast = 0, max = 255):
+        """Set the operations (applied in that order). Returns True if the table was rebuilt"""
+        key = (threshold, type, bool(equalize), brightness, contrast, max)
+        if key == self.key:
+            return False
+
+        self.key      = key
+        self.pre      = self.thresholdTable(threshold, type, max)
+        self.post     = self.brightnessContrastTable(brightness, contrast)
+        self.equalize = bool(equalize)
+        self.builds  += 1
+
+        if not self.equalize:
+            self.load([self.post[v] for v in self.pre])
+
+        return True
+
+    def apply(self, frame):
+        """Apply all operations to given 8-bit frame in a single pass"""
+        if self.equalize:
+            cv.CalcArrHist([frame], self.hist)
+
+            # Histogram of the thresholded frame, without thresholding it
+            counts = [0] * 256
+            for i in range(256):
+                counts[self.pre[i]] += int(cv.QueryHistValue_1D(self.hist, i))
+
+            eq = self.equalizeTable(counts, frame.width * frame.height)
+            self.load([self.post[eq[v]] for v in self.pre])
+
+        cv.LUT(frame, frame, self.lut)
+
+    def load(self, table):
+        """Use given list of 256 values as lookup table"""
+        self.lut = cv.CreateMatHeader(1, 256, cv.CV_8UC1)
+        cv.SetData(self.lut, "".join([chr(v) for v in table]), 256)
+
+    def thresholdTable(self, threshold, type, max = 255):
+        """Get the lookup table of cv.Threshold()"""
+        if threshold is None or type is None:
+            return range(256)
+
+        table = []
+        for v in range(256):
+            above = v > threshold
+            if type == cv.CV_THRESH_BINARY:
+                table.append(max if above else 0)
+            elif type == cv.CV_THRESH_BINARY_INV:
+                table.append(0 if above else max)
+            elif type == cv.CV_THRESH_TRUNC:
+                table.append(int(threshold) if above else v)
+            elif type == cv.CV_THRESH_TOZERO:
+                table.append(v if above else 0)
+            elif type == cv.CV_THRESH_TOZERO_INV:
+                table.append(0 if above else v)
+            else:
+                table.append(v)
+
+        return table
+
+    def brightnessContrastTable(self, brightness, contrast):
+        """Get the lookup table of OCVBrightnessContrast()"""
+        a, b = OCVBrightnessContrastScale(contrast, brightness)
+        return [min(255, max(0, cv.Round(v * a + b))) for v in range(256)]
+
+    def equalizeTable(self, counts, total):
+        """Get the lookup table of cv.EqualizeHist() for given histogram"""
+        table = [0] * 256
+
+        i = 0
+        while i < 255 and not counts[i]:
+            i += 1
+
+        if counts[i] == total:
+            return [i] * 256
+
+        scale = 255. / (total - counts[i])
+        sum   = 0
+        for j in range(i + 1, 256):
+            sum += counts[j]
+            table[j] = min(255, cv.Round(sum * scale))
+
+        return table
+
+#
+# Class: OCVFutureGroup -- Result of a set of asynchronous requests
+#
+class OCVFutureGroup(OCVFuture):
+
+    def __init__(self, futures, combine):
+        """ Combine several OCVFuture instances into one
+            - 'combine' gets the list of results once all are done
+            - Cancelling cancels every request that has not started yet, and the
+              group itself as soon as one request is dropped (no partial results)
+        """
+        OCVFuture.__init__(self)
+        self.futures = futures
+
+        if not futures:
+            self.finish(combine([]))
+            return
+
+        def collect():
+            results = []
+            for f in futures:
+                try:
+                    results.append(f.result())
+                except Exception:
+                    results.append(None)
+
+            value = combine(results)
+            with self.lock:
+                if self.state != "queued":
+                    return
+                self.state = "done"
+                self.value = value
+            self.event.set()
+
+        thread = threading.Thread(target=collect, name="OCVFutureGroup")
+        thread.daemon = True
+        thread.start()
+
+    def cancel(self):
+        """Cancel the requests that have not started yet. True if the group was cancelled"""
+        cancelled = [f.cancel() for f in self.futures]
+        if not any(cancelled):
+            return False
+
+        with self.lock:
+            if self.state != "queued":
+                return False
+            self.state = "cancelled"
+        self.event.set()
+        return True
+
+    def running(self):
+        """Check if any request is being processed"""
+        if self.done():
+            return False
+        for f in self.futures:
+            if f.running() or f.done():
+                return True
+        return False
+
+#
+# Class: OCVTextRegionReader -- OCR of Candidate Text Regions
+#
+class OCVTextRegionReader:
+
+    def __init__(self, engine = None, psm = TEXT_REGION_PSM, padding = TEXT_REGION_PADDING):
+        """ Read text region by region (see OCVTextRegions)
+            - Every region is cropped (with 'padding') and read concurrently with 'psm'
+            - Results are (text, (x, y, w, h)) in reading order
+            - Can be used as the engine of an OCVTextQueue
+        """
+        self.engine  = engine
+        self.psm     = psm
+        self.padding = padding
+
+    def regions(self, frame):
+        """Get padded candidate text regions"""
+        regions = OCVTextRegions(frame)
+
+        result = []
+        for (x, y, w, h) in regions:
+            x1 = max(0, x - self.padding)
+            y1 = max(0, y - self.padding)
+            x2 = min(frame.width, x + w + self.padding)
+            y2 = min(frame.height, y + h + self.padding)
+            result.append((x1, y1, x2 - x1, y2 - y1))
+        return result
+
+    def submit(self, frame, psm = None, lang = None, timeout = None):
+        """Queue all regions of frame for OCR and return an OCVFuture ('psm' is ignored)"""
+        engine  = self.engine or OCVTesseractEngine()
+        rects   = self.regions(frame)
+        futures = []
+        for rect in rects:
+            crop = cv.GetImage(cv.GetSubRect(frame, rect))
+            futures.append(engine.submit(crop, self.psm, lang, timeout))
+
+        return OCVFutureGroup(futures, lambda texts: self.order(zip(texts, rects)))
+
+    def read(self, frame, psm = None, lang = None, timeout = None):
+        """Read all regions of frame (blocking)"""
+        return self.submit(frame, psm, lang, timeout).result()
+
+    def order(self, results):
+        """Sort (text, rect) in reading order: lines top to bottom, left to right within a line"""
+        lines = []
+        for (text, rect) in sorted(results, key=lambda r: r[1][1]):
+            if not text or not text.strip():
+                continue
+
+            center = rect[1] + rect[3] / 2
+            if lines and lines[-1][0] <= center < lines[-1][1]:
+                lines[-1][2].append((text.strip(), rect))
+            else:
+                lines.append((rect[1], rect[1] + rect[3], [(text.strip(), rect)]))
+
+        result = []
+        for (top, bottom, items) in lines:
+            result.extend(sorted(items, key=lambda r: r[1][0]))
+        return result
+
 #
 # Class: CVCapture -- OpenCV Capture Device Instance
 #
@@ -252,27 +1652,63 @@ class OCVCapture:
             self.capture = cv.CaptureFromFile(id)
         else:
             self.capture = cv.CreateCameraCapture(id)
-            cv.SetCaptureProperty(self.capture, cv.CV_CAP_PROP_FRAME_WIDTH, width)
-            cv.SetCaptureProperty(self.capture, cv.CV_CAP_PROP_FRAME_HEIGHT, height)
+            if width is not None:
+                cv.SetCaptureProperty(self.capture, cv.CV_CAP_PROP_FRAME_WIDTH, width)
+            if height is not None:
+                cv.SetCaptureProperty(self.capture, cv.CV_CAP_PROP_FRAME_HEIGHT, height)
+
+        self.reader = None
 
     def __del__(self):
         """Destroy instance"""
         try:
+            self.stop()
             cv.ReleaseCapture(self.capture)
         except:
             pass
 
+    def start(self, size = CAPTURE_BUFFER, mode = CAPTURE_MODE):
+        """Start grabbing frames in the background (see OCVCaptureReader)"""
+        if self.reader is None:
+            self.reader = OCVCaptureReader(self, size, mode)
+        return self.reader
+
+    def stop(self):
+        """Stop the background grabber, if any"""
+        if self.reader is not None:
+            self.reader.stop()
+            self.reader = None
+
     def grab(self):
         """Grab a frame from capture device"""
         return cv.GrabFrame(self.capture)
 
+    def retrieve(self):
+        """Decode the last grabbed frame"""
+        return cv.RetrieveFrame(self.capture)
+
     def poll(self, flip = False):
         """Get a frame from device"""
+        if self.reader is not None:
+            # Ring frames can be returned more than once, the reader flips them when stored
+            self.reader.flip = flip
+            return self.reader.poll()
+
         frame = cv.QueryFrame(self.capture)
-        if flip:
+        if flip and frame is not None:
             cv.Flip(frame, None, 1)
         return frame
 
+    def resize(self, width, height):
+        """ Change the capture size
+            - With a background reader the change is made by its thread, which reallocates its ring
+        """
+        if self.reader is not None:
+            self.reader.resize(width, height)
+        else:
+            self.property(cv.CV_CAP_PROP_FRAME_WIDTH, width)
+            self.property(cv.CV_CAP_PROP_FRAME_HEIGHT, height)
+
     def properties(self, props = None):
         """Get/Set a list of capture device properties"""
         if type(props) is dict:
@@ -300,33 +1736,295 @@ class OCVCapture:
 
         return None
 
+#
+# Class: OCVCaptureReader -- Background Frame Grabber
+#
+class OCVCaptureReader:
+
+    LATEST  = "latest"
+    EVERY   = "every"
+
+    def __init__(self, capture, size = CAPTURE_BUFFER, mode = CAPTURE_MODE):
+        """ Grab frames from an OCVCapture in a background thread
+            - Frames are copied into a ring of 'size' preallocated frames
+            - LATEST mode: poll() returns the newest frame, older unread ones are dropped
+            - EVERY mode: poll() returns frames in order, the oldest is dropped when the ring is full
+        """
+        self.capture  = capture
+        self.size     = max(3, size)
+        self.mode     = mode
+        self.flip     = False
+        self.frames   = []
+        self.ready    = deque()
+        self.held     = None
+        self.cond     = threading.Condition()
+        self.running  = True
+        self.eof      = False
+        self.error    = None
+        self.request  = None
+        self.grabbed  = 0
+        self.polled   = 0
+        self.dropped  = 0
+
+        self.thread = threading.Thread(target=self.run, name="OCVCaptureReader")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        """Grabber loop (any error ends the stream, see 'error')"""
+        try:
+            self.grabber()
+        except Exception, e:
+            print "Capture reader failed: %s" % e
+            self.error = e
+        finally:
+            with self.cond:
+                self.eof = True
+                self.cond.notify_all()
+
+    def grabber(self):
+        """Grab frames into the ring until stopped or exhausted"""
+        while self.running:
+            if self.request is not None:
+                with self.cond:
+                    (width, height), self.request = self.request, None
+                self.capture.property(cv.CV_CAP_PROP_FRAME_WIDTH, width)
+                self.capture.property(cv.CV_CAP_PROP_FRAME_HEIGHT, height)
+
+            frame = None
+            if self.capture.grab():
+                frame = self.capture.retrieve()
+
+            with self.cond:
+                if frame is None:
+                    break
+
+                # (Re)allocate the ring for the first frame and after a size change. The
+                # frame held by the caller stays valid, it just is not reused
+                if not self.frames or (self.frames[0].width, self.frames[0].height) != (frame.width, frame.height):
+                    self.frames = [cv.CreateImage((frame.width, frame.height), frame.depth, frame.nChannels)
+                                   for i in range(self.size)]
+                    self.ready.clear()
+                    self.held = None
+
+                slot = self.slot()
+                if self.flip:
+                    cv.Flip(frame, self.frames[slot], 1)
+                else:
+                    cv.Copy(frame, self.frames[slot])
+                self.ready.append(slot)
+                self.grabbed += 1
+                self.cond.notify_all()
+
+    def slot(self):
+        """Find a ring slot to write into (call with lock held)"""
+        if self.mode == self.LATEST:
+            while self.ready:
+                self.ready.popleft()
+                self.dropped += 1
+
+        for i in range(self.size):
+            if i != self.held and i not in self.ready:
+                return i
+
+        self.dropped += 1
+        return self.ready.popleft()
+
+    def poll(self, timeout = None):
+        """ Get the next frame. The frame stays valid until the next poll()
+            - LATEST mode only waits for the very first frame, then never blocks
+            - EVERY mode waits for the next frame
+            - Returns None when the device/file is exhausted
+        """
+        with self.cond:
+            while not self.ready and not self.eof:
+                if self.mode == self.LATEST and self.held is not None:
+                    return self.frames[self.held]
+                self.cond.wait(timeout)
+                if timeout is not None:
+                    break
+
+            if not self.ready:
+                if self.eof:
+                    return None
+                return self.frames[self.held] if self.held is not None else None
+
+            self.held = self.ready.popleft()
+            self.polled += 1
+            return self.frames[self.held]
+
+    def resize(self, width, height):
+        """Change the capture size from the grabber thread"""
+        with self.cond:
+            self.request = (width, height)
+
+    def stop(self):
+        """Stop grabbing"""
+        self.running = False
+        if self.thread is not threading.current_thread():
+            self.thread.join(1.0)
+
+    def stats(self):
+        """Get reader statistics"""
+        with self.cond:
+            return {
+                "grabbed"  : self.grabbed,
+                "polled"   : self.polled,
+                "dropped"  : self.dropped,
+                "queued"   : len(self.ready)
+            }
+
+#
+# Class: OCVSourcePool -- One Capture Pipeline Process per Source
+#
+class OCVSourcePool:
+
+    def __init__(self, sources, pipeline, width = None, height = None, queue = SOURCE_QUEUE):
+        """ Start a worker process per source (device id or video file)
+            - Every frame is passed to 'pipeline(frame)', which returns a (picklable) result
+            - Results are collected through a queue of at most 'queue' entries
+        """
+        self.sources  = list(sources)
+        self.queue    = multiprocessing.Queue(queue)
+        self.halt     = multiprocessing.Event()
+        self.workers  = []
+        self.counts   = [0] * len(self.sources)
+        self.latency  = [0.] * len(self.sources)
+        self.started  = time.time()
+
+        for index, source in enumerate(self.sources):
+            worker = multiprocessing.Process(target=OCVSourceWorker, name="OCVSource-%d" % index,
+                        args=(index, source, width, height, pipeline, self.queue, self.halt))
+            worker.daemon = True
+            worker.start()
+            self.workers.append(worker)
+
+    def events(self, latency = SOURCE_LATENCY):
+        """ Yield results of all sources, ordered by capture time
+            - Events are held back 'latency' seconds to allow slower sources to catch up
+            - Each event is a dict of source, index, seq, time and result
+            - A source that fails gives an event with seq None and an "error" result
+        """
+        pending = []
+        done    = set()
+        running = len(self.workers)
+
+        while running or pending:
+            if running:
+                try:
+                    stamp, index, seq, result = self.queue.get(True, latency)
+                    if seq is not None:
+                        heapq.heappush(pending, (stamp, index, seq, result))
+                    elif index not in done:
+                        done.add(index)
+                        running -= 1
+                        if result is not None:
+                            heapq.heappush(pending, (stamp, index, seq, result))
+                except Queue.Empty:
+                    # A worker that died without saying goodbye must not hang the merge
+                    for index, worker in enumerate(self.workers):
+                        if index not in done and not worker.is_alive():
+                            done.add(index)
+                            running -= 1
+                            heapq.heappush(pending, (time.time(), index, None,
+                                {"error": "Worker exited with code %s" % worker.exitcode}))
+
+            limit = time.time() - latency
+            while pending and (not running or pending[0][0] <= limit):
+                stamp, index, seq, result = heapq.heappop(pending)
+                if seq is not None:
+                    self.counts[index] += 1
+                    self.latency[index] = time.time() - stamp
+
+                yield {
+                    "source"  : self.sources[index],
+                    "index"   : index,
+                    "seq"     : seq,
+                    "time"    : stamp,
+                    "result"  : result
+                }
+
+    def stop(self):
+        """Stop all workers"""
+        self.halt.set()
+        for worker in self.workers:
+            worker.join(1.0)
+            if worker.is_alive():
+                worker.terminate()
+
+    def stats(self):
+        """Get per-source frame count, throughput and latency"""
+        elapsed = max(time.time() - self.started, 1e-6)
+        result  = []
+        for index, source in enumerate(self.sources):
+            result.append({
+                "source"  : source,
+                "frames"  : self.counts[index],
+                "fps"     : self.counts[index] / elapsed,
+                "latency" : self.latency[index],
+                "alive"   : self.workers[index].is_alive()
+            })
+        return result
+
+def OCVSourceWorker(index, source, width, height, pipeline, queue, halt):
+    """Capture and process frames of a single source (runs in its own process)"""
+    seq   = 0
+    error = None
+
+    try:
+        capture = OCVCapture(source, width, height)
+        while not halt.is_set():
+            frame = capture.poll()
+            if frame is None:
+                break
+
+            stamp = time.time()
+            try:
+                result = pipeline(frame)
+            except Exception, e:
+                result = {"error": str(e)}
+
+            queue.put((stamp, index, seq, result))
+            seq += 1
+    except Exception, e:
+        error = {"error": str(e)}
+    finally:
+        queue.put((time.time(), index, None, error))
+
 #
 # Class: CVWindow -- OpenCV Window Abstraction
 #
 class OCVWindow:
 
-    def __init__(self, name, x = None, y = None, w = None, h = None):
+    def __init__(self, name, x = None, y = None, w = None, h = None, sink = None):
         """ Create OpenCV Window.
             - Auto-resize if now size is given.
             - Auto-position to 0x0 if no pos given
+            - Frames go to 'sink' (a HighGUI window by default, see OCVSink)
         """
+        if sink is None:
+            sink = OCVHighGUISink()
 
-        if w is not None and h is not None:
-            cv.NamedWindow(name, 0)
-            cv.ResizeWindow(name, w, h)
-        else:
-            cv.NamedWindow(name, cv.CV_WINDOW_AUTOSIZE)
+        if sink.windowed:
+            if w is not None and h is not None:
+                cv.NamedWindow(name, 0)
+                cv.ResizeWindow(name, w, h)
+            else:
+                cv.NamedWindow(name, cv.CV_WINDOW_AUTOSIZE)
 
-        if x is not None and y is not None:
-            cv.MoveWindow(name, x, y)
+            if x is not None and y is not None:
+                cv.MoveWindow(name, x, y)
 
         self.name     = name
+        self.sink     = sink
         self.settings = {}
 
     def __del__(self):
         """Remove OpenCV Window"""
         try:
-            cv.DestroyWindow(self.name)
+            self.sink.close()
+            if self.sink.windowed:
+                cv.DestroyWindow(self.name)
         except:
             pass
 
@@ -341,16 +2039,203 @@ class OCVWindow:
             self.handleTrackbarEvent(name, a)
             callback(name, a)
 
-        cv.CreateTrackbar(name, self.name, val, maxval, wrapper)
+        if self.sink.windowed:
+            cv.CreateTrackbar(name, self.name, val, maxval, wrapper)
         wrapper(val)
 
     def handleTrackbarEvent(self, name, val):
         """Handle Trackbar onchange"""
         self.settings[name] = int(val)
 
+    def due(self):
+        """Check if the sink wants a frame now (skip preparing one otherwise)"""
+        return self.sink.due()
+
     def render(self, frame):
         """Render the selected frame"""
-        cv.ShowImage(self.name, frame)
+        if self.sink.due():
+            self.sink.render(self.name, frame)
+
+#
+# Class: OCVSink -- Render Sink (discards frames)
+#
+class OCVSink:
+
+    windowed = False
+
+    def __init__(self, fps = None):
+        """ Create a sink for OCVWindow frames
+            - With 'fps' at most that many frames per second are emitted
+        """
+        self.fps     = fps
+        self.last    = 0
+        self.emitted = 0
+
+    def due(self):
+        """Check if a frame would be emitted now"""
+        if not self.fps:
+            return True
+        return time.time() - self.last >= 1. / self.fps
+
+    def render(self, name, frame):
+        """Emit a frame"""
+        self.last     = time.time()
+        self.emitted += 1
+        self.emit(name, frame)
+
+    def emit(self, name, frame):
+        """Output a frame (override this)"""
+        pass
+
+    def close(self):
+        """Release resources"""
+        pass
+
+#
+# Class: OCVNullSink -- Render nowhere
+#
+class OCVNullSink(OCVSink):
+
+    def due(self):
+        """Never take a frame, so windows skip preparing one"""
+        return False
+
+#
+# Class: OCVHighGUISink -- Render to a HighGUI window
+#
+class OCVHighGUISink(OCVSink):
+
+    windowed = True
+
+    def emit(self, name, frame):
+        """Show frame in the window"""
+        cv.ShowImage(name, frame)
+
+#
+# Class: OCVImageSequenceSink -- Render to numbered image files
+#
+class OCVImageSequenceSink(OCVSink):
+
+    def __init__(self, pattern, fps = None):
+        """Create a new sink ('pattern' is formatted with the frame number, ex. 'out/frame-%06d.jpg')"""
+        OCVSink.__init__(self, fps)
+        self.pattern = pattern
+
+    def emit(self, name, frame):
+        """Save frame as the next image"""
+        cv.SaveImage(self.pattern % self.emitted, frame)
+
+#
+# Class: OCVVideoSink -- Render to a video file
+#
+class OCVVideoSink(OCVSink):
+
+    def __init__(self, path, fps = VIDEO_FPS, fourcc = cv.CV_FOURCC('M','J','P','G'), threaded = True):
+        """Create a new sink (the writer is opened with the size of the first frame)"""
+        OCVSink.__init__(self, fps)
+        self.path     = path
+        self.fourcc   = fourcc
+        self.threaded = threaded
+        self.video    = None
+
+    def emit(self, name, frame):
+        """Append frame to the video"""
+        if self.video is None:
+            self.video = OCVVideo(self.path, (frame.width, frame.height), self.fourcc, self.fps or VIDEO_FPS,
+                                  int(frame.nChannels != 1), self.threaded)
+        self.video.write(frame)
+
+    def close(self):
+        """Close the video"""
+        if self.video is not None:
+            self.video.close()
+            self.video = None
+
+#
+# Class: OCVMJPEGSink -- Serve frames as MJPEG over HTTP
+#
+class OCVMJPEGSink(OCVSink):
+
+    def __init__(self, port = MJPEG_PORT, fps = None, quality = MJPEG_QUALITY, host = MJPEG_HOST):
+        """Create a new sink (frames are only encoded while somebody is watching)"""
+        OCVSink.__init__(self, fps)
+        self.quality  = quality
+        self.jpeg     = None
+        self.seq      = 0
+        self.clients  = 0
+        self.running  = True
+        self.cond     = threading.Condition()
+
+        self.server = OCVMJPEGServer((host, port), OCVMJPEGHandler)
+        self.server.sink = self
+        self.thread = threading.Thread(target=self.server.serve_forever, name="OCVMJPEGSink")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def due(self):
+        """Check if a frame would be emitted now (never without clients)"""
+        return self.clients > 0 and OCVSink.due(self)
+
+    def emit(self, name, frame):
+        """Encode frame and hand it to the clients"""
+        jpeg = cv.EncodeImage(".jpg", frame, [cv.CV_IMWRITE_JPEG_QUALITY, self.quality]).tostring()
+        with self.cond:
+            self.jpeg = jpeg
+            self.seq += 1
+            self.cond.notify_all()
+
+    def wait(self, seq, timeout = 1.0):
+        """Wait for a frame newer than 'seq'. Returns (jpeg, seq)"""
+        with self.cond:
+            if self.seq == seq and self.running:
+                self.cond.wait(timeout)
+            return (self.jpeg, self.seq)
+
+    def close(self):
+        """Stop serving"""
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
+
+class OCVMJPEGServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads      = True
+    allow_reuse_address = True
+
+class OCVMJPEGHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        """Stream frames until the client goes away"""
+        sink = self.server.sink
+
+        self.send_response(200)
+        self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        with sink.cond:
+            sink.clients += 1
+
+        seq = sink.seq
+        try:
+            while sink.running:
+                jpeg, current = sink.wait(seq)
+                if current == seq or jpeg is None:
+                    continue
+
+                seq = current
+                self.wfile.write("--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(jpeg))
+                self.wfile.write(jpeg)
+                self.wfile.write("\r\n")
+        except socket.error:
+            pass
+        finally:
+            with sink.cond:
+                sink.clients -= 1
+
+    def log_message(self, *args):
+        pass
 
 
 #
@@ -384,6 +2269,23 @@ class OCVImage:
         """Destroy Instance"""
         pass
 
+    def release(self):
+        """Give the frame back to the frame pool (the instance is unusable afterwards)"""
+        OCVFrames.release(self.frame)
+        self.frame = None
+
+    def replace(self, frame):
+        """Use a new frame, giving the old one back to the frame pool"""
+        if frame is not self.frame:
+            OCVFrames.release(self.frame)
+
+        self.frame    = frame
+        self.depth    = frame.depth
+        self.channels = frame.nChannels
+        self.width    = frame.width
+        self.height   = frame.height
+        self.size     = (self.width, self.height)
+
     # MISC
 
     def clone(self):
@@ -405,10 +2307,7 @@ class OCVImage:
 
     def resize(self, size):
         """Resize image to given dimension"""
-        self.frame  = OCVResizeImage(self.frame, size)
-        self.width  = img.width
-        self.height = img.height
-        self.size   = (self.width, self.height)
+        self.replace(OCVResizeImage(self.frame, size))
 
     def crop(self, x, y, w, h):
         """Crop image to given dimension/position"""
@@ -421,9 +2320,7 @@ class OCVImage:
         """Convert image to given number of channels"""
         if self.channels != channels:
             if channels == 1:
-                self.frame    = OCVCopyGrayscale(self.frame)
-                self.channels = self.frame.nChannels
-                self.depth    = self.frame.depth
+                self.replace(OCVCopyGrayscale(self.frame))
 
                 return True
 
@@ -449,7 +2346,7 @@ class OCVImage:
         else:
             self.font = font
 
-        self.frame = OCVText(self.frame, text, x, y, step, self.font)
+        self.replace(OCVText(self.frame, text, x, y, step, self.font))
 
     def line(self, p1, p2, color = (0, 255, 0), border = 1, line = 8):
         """Draw a line"""
@@ -499,11 +2396,34 @@ class OCVImage:
         """Get Mat array"""
         return cv.CreateMat(self.width, self.height, cv.CV_32FC1)
 
-    def getFeatures(self, count = 10, quality = None, dist = 1.0, use_harris = True):
-        """Get good features to track"""
-        tmp     = cv.CreateImage((self.width, self.height), self.depth, self.channels)
-        results = cv.GoodFeaturesToTrack(img, self.frame, tmp, count, quality, dist, use_harris)
-        return (tmp, results)
+    def getFeatures(self, count = 10, quality = 0.01, dist = 1.0, use_harris = False, rect = None):
+        """ Get good features to track
+            - Only looks inside 'rect' (x, y, w, h) if given. Points are in frame coordinates
+            - The returned eigen image comes from the frame pool (release it when done)
+        """
+        if self.channels != 1:
+            gray = OCVCopyGrayscale(self.frame)
+        else:
+            gray = self.frame
+
+        src  = gray
+        size = self.size
+        if rect is not None:
+            src  = cv.GetSubRect(gray, rect)
+            size = (rect[2], rect[3])
+
+        eig     = OCVFrames.acquire(size, cv.IPL_DEPTH_32F, 1)
+        tmp     = OCVFrames.acquire(size, cv.IPL_DEPTH_32F, 1)
+        results = cv.GoodFeaturesToTrack(src, eig, tmp, count, quality, dist, None, 3, use_harris)
+
+        OCVFrames.release(tmp)
+        if gray is not self.frame:
+            OCVFrames.release(gray)
+
+        if rect is not None:
+            results = [(x + rect[0], y + rect[1]) for (x, y) in results]
+
+        return (eig, results)
 
     def getHistogram(self, ranges = [[0, 256]], hist_size = 64):
         """Get image histogram"""
@@ -527,23 +2447,992 @@ class OCVImage:
         """Set brightness / contrast of given frame. Values from 0 to 200"""
         OCVBrightnessContrast(self.frame, contrast, brightness)
 
+#
+# Class: OCVObjectTracker -- Detect-then-track Objects
+#
+class OCVObjectTracker:
+
+    def __init__(self, interval = TRACK_INTERVAL, drift = TRACK_DRIFT, points = TRACK_POINTS, overlap = TRACK_OVERLAP):
+        """ Track detected objects between detections with pyramidal Lucas-Kanade
+            - A full detection runs every 'interval' frames, or when a track is lost
+            - A track is lost when more than 'drift' (0..1) of its points fail to follow
+            - Objects keep their ID as long as they overlap ('overlap' IoU) a new detection
+        """
+        self.interval   = interval
+        self.drift      = drift
+        self.points     = points
+        self.overlap    = overlap
+        self.tracks     = []
+        self.next       = 1
+        self.since      = 0
+        self.prev       = None
+        self.pyramids   = [None, None]
+        self.ready      = False
+        self.criteria   = (cv.CV_TERMCRIT_ITER | cv.CV_TERMCRIT_EPS, 20, 0.03)
+        self.detections = 0
+        self.frames     = 0
+
+    def reset(self):
+        """Forget all tracks"""
+        self.tracks = []
+        OCVFrames.release(self.prev)
+        self.prev   = None
+        self.ready  = False
+
+    def update(self, image, detect):
+        """ Update tracks for given OCVImage
+            - 'detect' is called (without arguments) when a detection is needed and
+              must return a list of ((x, y, w, h), neighbors)
+            - Returns a list of (id, (x, y, w, h))
+        """
+        if image.channels != 1:
+            gray = OCVCopyGrayscale(image.frame)
+        else:
+            gray = OCVCloneImage(image.frame)
+
+        self.frames += 1
+        lost = True
+        if self.prev is not None and self.tracks and self.since < self.interval:
+            if (self.prev.width, self.prev.height) == (gray.width, gray.height):
+                lost = self.flow(gray)
+
+        if lost:
+            self.match(detect(), gray)
+            self.detections += 1
+            self.since = 0
+        else:
+            self.since += 1
+
+        OCVFrames.release(self.prev)
+        self.prev = gray
+
+        return [(t["id"], t["rect"]) for t in self.tracks]
+
+    def match(self, objects, gray):
+        """Replace tracks with new detections, keeping IDs of overlapping ones"""
+        image  = OCVImage(gray, noclone=True)
+        tracks = []
+
+        for (rect, n) in objects or []:
+            best, score = None, self.overlap
+            for t in self.tracks:
+                s = self.iou(rect, t["rect"])
+                if s >= score:
+                    best, score = t, s
+
+            if best is not None:
+                self.tracks.remove(best)
+                id = best["id"]
+            else:
+                id = self.next
+                self.next += 1
+
+            eig, points = image.getFeatures(self.points, rect=rect)
+            OCVFrames.release(eig)
+            tracks.append({"id": id, "rect": rect, "points": points})
+
+        self.tracks = tracks
+        self.ready  = False
+
+    def flow(self, gray):
+        """Move tracks along the optical flow. Returns True if a track was lost"""
+        size = (gray.width + 8, gray.height / 3)
+        for i in (0, 1):
+            self.pyramids[i] = OCVFrames.reuse(self.pyramids[i], size, cv.IPL_DEPTH_8U, 1)
+
+        points = []
+        for t in self.tracks:
+            points.extend(t["points"])
+        if not points:
+            return True
+
+        flags = cv.CV_LKFLOW_PYR_A_READY if self.ready else 0
+        moved, status, errors = cv.CalcOpticalFlowPyrLK(self.prev, gray, self.pyramids[0], self.pyramids[1],
+                                    points, (15, 15), 3, self.criteria, flags)
+
+        # The current pyramid is the previous one next time
+        self.pyramids.reverse()
+        self.ready = True
+
+        lost = False
+        i    = 0
+        for t in self.tracks:
+            dx, dy, good = [], [], []
+            for p in t["points"]:
+                if status[i]:
+                    dx.append(moved[i][0] - p[0])
+                    dy.append(moved[i][1] - p[1])
+                    good.append(moved[i])
+                i += 1
+
+            if not good or len(good) < (1. - self.drift) * len(t["points"]):
+                lost = True
+                continue
+
+            dx.sort()
+            dy.sort()
+            x, y, w, h  = t["rect"]
+            t["rect"]   = (int(round(x + dx[len(dx) / 2])), int(round(y + dy[len(dy) / 2])), w, h)
+            t["points"] = good
+
+        return lost
+
+    def iou(self, a, b):
+        """Intersection over union of two rectangles"""
+        w = min(a[0] + a[2], b[0] + b[2]) - max(a[0], b[0])
+        h = min(a[1] + a[3], b[1] + b[3]) - max(a[1], b[1])
+        if w <= 0 or h <= 0:
+            return 0.
+        i = float(w * h)
+        return i / (a[2] * a[3] + b[2] * b[3] - i)
+
+    def stats(self):
+        """Get tracker statistics"""
+        return {
+            "tracks"     : len(self.tracks),
+            "frames"     : self.frames,
+            "detections" : self.detections
+        }
+
+#
+# Class: OCVMotionGate -- Motion-gated Detection
+#
+class OCVMotionGate:
+
+    def __init__(self, alpha = MOTION_ALPHA, threshold = MOTION_THRESHOLD, padding = MOTION_PADDING, area = MOTION_AREA):
+        """ Only run detection where something changed
+            - The background is a running average ('alpha' 1.0 means plain frame differencing)
+            - Pixels differing more than 'threshold' from it count as motion
+            - Changed areas smaller than 'area' pixels are ignored, the others are padded by 'padding'
+        """
+        self.alpha      = alpha
+        self.threshold  = threshold
+        self.padding    = padding
+        self.area       = area
+        self.background = None
+        self.reference  = None
+        self.mask       = None
+        self.objects    = []
+        self.frames     = 0
+        self.skipped    = 0
+
+    def reset(self):
+        """Forget the background and previous results"""
+        for frame in (self.background, self.reference, self.mask):
+            OCVFrames.release(frame)
+
+        self.background = None
+        self.reference  = None
+        self.mask       = None
+        self.objects    = []
+
+    def regions(self, frame, storage):
+        """ Get a list of changed areas (x, y, w, h) since the last call
+            - Returns None when there is no background to compare with yet
+        """
+        size = (frame.width, frame.height)
+        if frame.nChannels != 1:
+            gray = OCVCopyGrayscale(frame)
+        else:
+            gray = frame
+
+        if self.background is None or (self.background.width, self.background.height) != size:
+            self.reset()
+            self.background = OCVFrames.acquire(size, cv.IPL_DEPTH_32F, 1)
+            self.reference  = OCVFrames.acquire(size, cv.IPL_DEPTH_8U, 1)
+            self.mask       = OCVFrames.acquire(size, cv.IPL_DEPTH_8U, 1)
+            cv.ConvertScale(gray, self.background)
+            result = None
+        else:
+            cv.ConvertScale(self.background, self.reference)
+            cv.AbsDiff(gray, self.reference, self.mask)
+            cv.Threshold(self.mask, self.mask, self.threshold, 255, cv.CV_THRESH_BINARY)
+            cv.Dilate(self.mask, self.mask, None, 2)
+            cv.RunningAvg(gray, self.background, self.alpha)
+
+            result = []
+            with OCVStorages.scope(storage) as storage:
+                contours = cv.FindContours(self.mask, storage, cv.CV_RETR_EXTERNAL, cv.CV_CHAIN_APPROX_SIMPLE)
+                while contours:
+                    (x, y, w, h) = cv.BoundingRect(contours)
+                    if w * h >= self.area:
+                        result.append(self.pad((x, y, w, h), size))
+                    contours = contours.h_next()
+
+            result = self.merge(result)
+
+        if gray is not frame:
+            OCVFrames.release(gray)
+
+        return result
+
+    def detect(self, frame, storage, haar, detect = None):
+        """ Detect objects only inside changed areas
+            - 'detect' defaults to OCVObjects(frame, storage, haar)
+            - Frames without motion reuse the previous results
+        """
+        if detect is None:
+            detect = OCVObjects
+
+        self.frames += 1
+        rois = self.regions(frame, storage)
+        if rois is None:
+            self.objects = list(detect(frame, storage, haar))
+            return self.objects
+
+        if not rois:
+            self.skipped += 1
+            return self.objects
+
+        # Keep earlier objects in areas that did not change
+        objects = [o for o in self.objects if not [r for r in rois if self.intersects(o[0], r)]]
+        for roi in rois:
+            sub = cv.GetSubRect(frame, roi)
+            for ((x, y, w, h), n) in detect(sub, storage, haar):
+                objects.append(((x + roi[0], y + roi[1], w, h), n))
+
+        self.objects = objects
+        return objects
+
+    def pad(self, rect, size):
+        """Grow rectangle by padding, clipped to frame"""
+        (x, y, w, h) = rect
+        x1 = max(0, x - self.padding)
+        y1 = max(0, y - self.padding)
+        x2 = min(size[0], x + w + self.padding)
+        y2 = min(size[1], y + h + self.padding)
+        return (x1, y1, x2 - x1, y2 - y1)
+
+    def merge(self, rects):
+        """Merge overlapping rectangles"""
+        rects = list(rects)
+        merged = True
+        while merged:
+            merged = False
+            for i in range(len(rects)):
+                for j in range(i + 1, len(rects)):
+                    if self.intersects(rects[i], rects[j]):
+                        a, b = rects[i], rects[j]
+                        x, y = min(a[0], b[0]), min(a[1], b[1])
+                        rects[i] = (x, y, max(a[0] + a[2], b[0] + b[2]) - x, max(a[1] + a[3], b[1] + b[3]) - y)
+                        del rects[j]
+                        merged = True
+                        break
+                if merged:
+                    break
+
+        return rects
+
+    def intersects(self, a, b):
+        """Check if two rectangles overlap"""
+        return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+    def stats(self):
+        """Get gate statistics"""
+        return {
+            "frames"   : self.frames,
+            "skipped"  : self.skipped
+        }
+
+#
+# Class: OCVDetector -- Haar Detection On A Prepared (Downscaled) Frame
+#
+class OCVDetector:
+
+    def __init__(self, scale = HAAR_SCALE, scale_factor = HAAR_SCALE_FACTOR, min_neighbors = HAAR_NEIGHBORS,
+                 flags = HAAR_FLAGS, min_size = HAAR_MIN_SIZE, max_size = HAAR_MAX_SIZE, canny = False, equalize = False):
+        """ Create a new detector
+            - Cascades run on a grayscale copy downscaled by 'scale' (0..1), rectangles are
+              mapped back to frame coordinates
+            - 'min_size' and 'max_size' (w, h) are in frame pixels. The legacy binding has no
+              maximum size, so larger objects are dropped afterwards
+            - 'canny' adds CV_HAAR_DO_CANNY_PRUNING to 'flags', 'equalize' equalizes the copy
+            - An instance keeps its buffers between frames, use one per thread
+        """
+        self.scale         = min(1.0, scale)
+        self.scale_factor  = scale_factor
+        self.min_neighbors = min_neighbors
+        self.flags         = flags | (cv.CV_HAAR_DO_CANNY_PRUNING if canny else 0)
+        self.min_size      = min_size
+        self.max_size      = max_size
+        self.equalize      = equalize
+        self.gray          = None
+        self.small         = None
+        self.factor        = 1.0
+
+    def prepare(self, frame):
+        """ Get the grayscale, equalized and downscaled frame cascades run on
+            - Valid until the next call, pass it to search() for every cascade
+        """
+        # Sub-rects (cv.GetSubRect) are matrices without IplImage attributes
+        channels = getattr(frame, "nChannels", None) or cv.CV_MAT_CN(frame.type)
+        size     = (frame.width, frame.height)
+        img      = frame
+
+        if channels != 1 or self.equalize:
+            self.gray = OCVFrames.reuse(self.gray, size, cv.IPL_DEPTH_8U, 1)
+            if channels != 1:
+                cv.CvtColor(img, self.gray, cv.CV_BGR2GRAY)
+            else:
+                cv.Copy(img, self.gray)
+            if self.equalize:
+                cv.EqualizeHist(self.gray, self.gray)
+            img = self.gray
+
+        self.factor = 1.0
+        if self.scale < 1.0:
+            small       = (max(1, int(size[0] * self.scale)), max(1, int(size[1] * self.scale)))
+            self.small  = OCVFrames.reuse(self.small, small, cv.IPL_DEPTH_8U, 1)
+            self.factor = float(small[0]) / size[0]
+            cv.Resize(img, self.small, cv.CV_INTER_AREA)
+            img = self.small
+
+        return img
+
+    def search(self, prepared, haar, storage = None):
+        """ Run a cascade on a prepared frame (see prepare())
+            - Returns a list of ((x, y, w, h), neighbors) in frame coordinates
+        """
+        if isinstance(haar, (int, basestring)):
+            cascade = OCVCascades.get(haar)
+        else:
+            cascade = haar
+
+        f        = self.factor
+        min_size = (int(self.min_size[0] * f), int(self.min_size[1] * f))
+        with OCVStorages.scope(storage) as storage:
+            objects = cv.HaarDetectObjects(prepared, cascade, storage, self.scale_factor, self.min_neighbors, self.flags, min_size)
+
+        if f != 1.0:
+            objects = [((int(x / f), int(y / f), int(w / f), int(h / f)), n) for ((x, y, w, h), n) in objects]
+
+        if self.max_size:
+            objects = [o for o in objects if o[0][2] <= self.max_size[0] and o[0][3] <= self.max_size[1]]
+
+        return objects
+
+    def detect(self, frame, haar, storage = None):
+        """Detect objects of a single cascade"""
+        return self.search(self.prepare(frame), haar, storage)
+
+    def detectAll(self, frame, haars, storage = None):
+        """Detect objects of several cascades, preparing the frame once. Returns [(haar, objects)]"""
+        prepared = self.prepare(frame)
+        return [(haar, self.search(prepared, haar, storage)) for haar in haars]
+
+    def release(self):
+        """Give the buffers back to the frame pool"""
+        OCVFrames.release(self.gray)
+        OCVFrames.release(self.small)
+        self.gray  = None
+        self.small = None
+
+#
+# Class: OCVMultiDetector -- Several Cascades On One Prepared Frame
+#
+class OCVMultiDetector:
+
+    def __init__(self, haars, nested = None, detector = None, threads = HAAR_THREADS):
+        """ Run a set of cascades on one prepared frame
+            - The frame is prepared once (grayscale, equalized, downscaled) by 'detector'
+            - 'nested' maps a cascade to a parent cascade, it then only searches inside the
+              parent objects (ex. eyes inside faces)
+            - With 'threads' > 1 independent cascades run in a thread pool, otherwise one
+              after the other (compare both with bench.py --cascades before enabling it)
+            - Every cascade runs in a single thread at a time, cascades are not thread-safe
+        """
+        self.haars    = list(haars)
+        self.nested   = dict(nested or {})
+        self.detector = detector or OCVDetector(equalize=True)
+        self.names    = [self.name(h) for h in self.haars]
+        self.pool     = None
+
+        if min(threads, len(self.haars)) > 1:
+            self.pool = multiprocessing.pool.ThreadPool(min(threads, len(self.haars)))
+
+        for (child, parent) in self.nested.items():
+            if child not in self.haars or parent not in self.haars:
+                raise ValueError("Nested cascades must be in the set: %s in %s" % (child, parent))
+
+        # Hold on to the cascades, the registry only caches a few
+        self.cascades = dict([(h, OCVCascades.get(h)) for h in self.haars])
+
+    def name(self, haar):
+        """Get the name of a cascade (index, name or path)"""
+        return os.path.splitext(os.path.basename(OCVCascades.filename(haar)))[0]
+
+    def detect(self, frame):
+        """ Detect objects of every cascade
+            - Returns a list of (name, (x, y, w, h), neighbors) in frame coordinates
+        """
+        prepared = self.detector.prepare(frame)
+        found    = {}
+        pending  = list(self.haars)
+
+        # Cascades run as soon as their parent is done
+        while pending:
+            ready = [h for h in pending if h not in self.nested or self.nested[h] in found]
+            if not ready:
+                raise ValueError("Nested cascades form a loop: %s" % pending)
+
+            jobs = []
+            for haar in ready:
+                rois = None
+                if haar in self.nested:
+                    rois = [rect for (rect, n) in found[self.nested[haar]]]
+                jobs.append((prepared, haar, rois))
+
+            if self.pool is not None:
+                results = self.pool.map(self.search, jobs)
+            else:
+                results = map(self.search, jobs)
+
+            for haar, objects in zip(ready, results):
+                found[haar] = objects
+            pending = [h for h in pending if h not in found]
+
+        result = []
+        for haar, name in zip(self.haars, self.names):
+            for (rect, n) in found[haar]:
+                result.append((name, rect, n))
+        return result
+
+    def search(self, job):
+        """Run a cascade on the prepared frame, or inside 'rois' (frame coordinates) of it"""
+        prepared, haar, rois = job
+        cascade = self.cascades[haar]
+        if rois is None:
+            return self.detector.search(prepared, cascade)
+
+        f       = self.detector.factor
+        objects = []
+        for (x, y, w, h) in rois:
+            px, py = int(x * f), int(y * f)
+            pw, ph = min(prepared.width - px, max(1, int(w * f))), min(prepared.height - py, max(1, int(h * f)))
+            if pw <= 0 or ph <= 0:
+                continue
+
+            for ((ox, oy, ow, oh), n) in self.detector.search(cv.GetSubRect(prepared, (px, py, pw, ph)), cascade):
+                objects.append(((ox + int(px / f), oy + int(py / f), ow, oh), n))
+
+        return objects
+
+    def close(self):
+        """Stop the threads and give the buffers back"""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        self.detector.release()
+
+#
+# Class: OCVSceneGate -- Reuse Results While The Scene Is Unchanged
+#
+class OCVSceneGate:
+
+    def __init__(self, threshold = SCENE_THRESHOLD, size = SCENE_SIZE):
+        """ Create a new gate
+            - Frames are compared by the mean absolute difference of 'size' grayscale thumbnails
+            - A result is reused while its frame differs less than 'threshold' (0-255)
+        """
+        self.threshold = threshold
+        self.size      = size
+        self.diff      = cv.CreateMat(size[1], size[0], cv.CV_8UC1)
+        self.entries   = {}
+        self.frames    = 0
+        self.checks    = 0
+        self.skipped   = 0
+
+    def reset(self):
+        """Forget all results"""
+        self.entries = {}
+
+    def signature(self, frame):
+        """Get the signature (thumbnail) of a frame"""
+        if frame.nChannels != 1:
+            gray = OCVCopyGrayscale(frame)
+        else:
+            gray = frame
+
+        thumb = cv.CreateMat(self.size[1], self.size[0], cv.CV_8UC1)
+        cv.Resize(gray, thumb, cv.CV_INTER_AREA)
+
+        if gray is not frame:
+            OCVFrames.release(gray)
+
+        self.frames += 1
+        return thumb
+
+    def distance(self, a, b):
+        """Get the mean absolute difference of two signatures"""
+        cv.AbsDiff(a, b, self.diff)
+        return cv.Avg(self.diff)[0]
+
+    def get(self, key, signature):
+        """Get the result stored under 'key' if its scene matches. Returns (found, result)"""
+        self.checks += 1
+        entry = self.entries.get(key)
+        if entry is None or self.distance(entry[0], signature) >= self.threshold:
+            return (False, None)
+
+        self.skipped += 1
+        return (True, entry[1])
+
+    def put(self, key, signature, result):
+        """Store the result of a scene"""
+        self.entries[key] = (signature, result)
+
+    def recall(self, key, signature, compute):
+        """Get a stored result, or store the result of 'compute()' if the scene changed"""
+        found, result = self.get(key, signature)
+        if not found:
+            result = compute()
+            self.put(key, signature, result)
+        return result
+
+    def stats(self):
+        """Get gate statistics"""
+        return {
+            "frames"  : self.frames,
+            "checks"  : self.checks,
+            "skipped" : self.skipped,
+            "ratio"   : float(self.skipped) / self.checks if self.checks else 0.
+        }
+
+#
+# Class: OCVQualityController -- Trade Quality for Frame Rate
+#
+class OCVQualityController:
+
+    # Settings at full quality (see QUALITY_STEPS)
+    DEFAULTS = [
+        ("preview",      None),
+        ("every",        1),
+        ("scale_factor", HAAR_SCALE_FACTOR),
+        ("downscale",    1.0),
+        ("capture",      1.0)
+    ]
+
+    def __init__(self, fps = QUALITY_FPS, steps = QUALITY_STEPS, capture = None, size = None,
+                 window = QUALITY_WINDOW, headroom = QUALITY_HEADROOM, recover = QUALITY_RECOVER, log = None):
+        """ Create a controller that keeps the loop at 'fps' frames per second
+            - 'steps' is a list of (setting, value), applied one by one when the loop is too slow
+              and taken back when it has been fast enough for 'recover' frames
+            - The capture resolution is set on 'capture' (scaled from 'size')
+            - Decisions are made at most every 'window' frames and passed to 'log' (printed by default)
+        """
+        self.budget    = 1. / fps
+        self.steps     = list(steps)
+        self.capture   = capture
+        self.size      = size
+        self.window    = window
+        self.headroom  = headroom
+        self.recover   = recover
+        self.log       = log
+        self.alpha     = 2. / (window + 1)
+
+        self.level     = 0
+        self.latency   = None
+        self.frames    = 0
+        self.wait      = window
+        self.calm      = 0
+        self.decisions = deque(maxlen=100)
+        self.settings  = self.resolve(0)
+
+    def resolve(self, level):
+        """Get settings for a level"""
+        settings = dict(self.DEFAULTS)
+        for (name, value) in self.steps[:level]:
+            settings[name] = value
+        return settings
+
+    def update(self, seconds):
+        """ Add the duration of a whole loop iteration (capture and UI wait included)
+            - Returns True if the settings changed
+        """
+        self.frames += 1
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += self.alpha * (seconds - self.latency)
+
+        if self.wait > 0:
+            self.wait -= 1
+            return False
+
+        if self.latency > self.budget and self.level < len(self.steps):
+            self.change(1)
+            return True
+
+        if self.level > 0 and self.latency < self.budget * (1. - self.headroom):
+            self.calm += 1
+            if self.calm >= self.recover:
+                self.change(-1)
+                return True
+        else:
+            self.calm = 0
+
+        return False
+
+    def change(self, step):
+        """Go 'step' levels down (positive) or up (negative) in quality"""
+        old            = self.settings
+        self.level    += step
+        self.settings  = self.resolve(self.level)
+        self.wait      = self.window
+        self.calm      = 0
+
+        changes = ["%s %s -> %s" % (name, old[name], self.settings[name])
+                   for (name, default) in self.DEFAULTS if old[name] != self.settings[name]]
+
+        if self.capture is not None and self.size and old["capture"] != self.settings["capture"]:
+            scale = self.settings["capture"]
+            self.capture.resize(int(self.size[0] * scale), int(self.size[1] * scale))
+
+        message = "Quality: %s to level %d/%d (%.1f ms, budget %.1f ms): %s" % (
+            "degrade" if step > 0 else "recover", self.level, len(self.steps),
+            self.latency * 1000., self.budget * 1000., ", ".join(changes))
+
+        self.decisions.append((time.time(), self.level, message))
+        if self.log is not None:
+            self.log(message)
+        else:
+            print message
+
+    def due(self):
+        """Check if detection should run on the current frame"""
+        return self.frames % self.settings["every"] == 0
+
+    def stats(self):
+        """Get controller statistics"""
+        return {
+            "level"     : self.level,
+            "fps"       : 1. / self.budget,
+            "latency"   : (self.latency or 0.) * 1000.,
+            "settings"  : dict(self.settings),
+            "decisions" : len(self.decisions)
+        }
+
 #
 # Class: OCVVideo -- OpenCV Video Class
 #
 class OCVVideo:
 
-    def __init__(self, path, size, fourcc = cv.CV_FOURCC('M','J','P','G'), fps=30, color=1):
-        """Create a new OpenCV Instance"""
-        self.writer = cv.CreateVideoWriter(path, fourcc, fps, size, color)
+    BLOCK = "block"
+    DROP  = "drop"
+
+    def __init__(self, path, size, fourcc = cv.CV_FOURCC('M','J','P','G'), fps=30, color=1, threaded=False, queue=VIDEO_QUEUE, policy=VIDEO_POLICY):
+        """ Create a new OpenCV Instance
+            - If 'threaded' frames are encoded by a background thread
+            - At most 'queue' frames wait to be written. When full, BLOCK waits and DROP discards the frame
+        """
+        self.writer   = cv.CreateVideoWriter(path, fourcc, fps, size, color)
+        self.policy   = policy
+        self.queue    = None
+        self.thread   = None
+        self.written  = 0
+        self.dropped  = 0
+        self.errors   = 0
+
+        if threaded:
+            self.queue  = Queue.Queue(queue)
+            self.thread = threading.Thread(target=self.run, name="OCVVideo")
+            self.thread.daemon = True
+            self.thread.start()
 
     def __del__(self):
         """Destroy instance"""
         try:
-            cv.ReleaseVideoWriter(self.writer)
+            self.close()
         except:
             pass
 
     def write(self, frame):
-        """Write a OpenCV image frame to the video"""
-        cv.WriteFrame(self.writer, frame)
+        """Write a OpenCV image frame to the video. Returns False if the frame was dropped"""
+        if self.writer is None:
+            return False
+
+        if self.queue is None:
+            cv.WriteFrame(self.writer, frame)
+            self.written += 1
+            return True
+
+        # Nobody would drain the queue
+        if not self.thread.is_alive():
+            self.dropped += 1
+            return False
+
+        copy = OCVCloneImage(frame)
+        try:
+            self.queue.put(copy, self.policy != self.DROP)
+        except Queue.Full:
+            OCVFrames.release(copy)
+            self.dropped += 1
+            return False
+
+        return True
+
+    def run(self):
+        """Writer loop (a failed frame is reported and skipped, the queue keeps draining)"""
+        while True:
+            frame = self.queue.get()
+            try:
+                if frame is None:
+                    break
+
+                cv.WriteFrame(self.writer, frame)
+                self.written += 1
+            except Exception, e:
+                self.errors += 1
+                print "Failed to write video frame: %s" % e
+            finally:
+                OCVFrames.release(frame)
+                self.queue.task_done()
+
+    def flush(self):
+        """Wait until every queued frame is written"""
+        if self.queue is not None:
+            self.queue.join()
+
+    def close(self):
+        """Write all queued frames and close the video"""
+        if self.thread is not None:
+            if self.thread.is_alive():
+                self.queue.put(None)
+                self.thread.join()
+            self.thread = None
+
+        if self.writer is not None:
+            try:
+                cv.ReleaseVideoWriter(self.writer)
+            except:
+                pass
+            self.writer = None
+
+    def stats(self):
+        """Get writer statistics"""
+        return {
+            "queued"   : self.queue.qsize() if self.queue is not None else 0,
+            "written"  : self.written,
+            "dropped"  : self.dropped
+        }
+
+#
+# Class: OCVFrameBus -- Shared Memory Frame Ring (Publisher)
+#
+class OCVFrameBus:
+
+    MAGIC   = "PYOCVBUS"
+    VERSION = 1
+
+    # magic, version, slots, width, height, channels, step, head
+    HEADER  = struct.Struct("<8sIIIIIIQ")
+
+    # start seq, end seq, timestamp (a slot is consistent when both seqs match)
+    SLOT    = struct.Struct("<QQd")
+    ALIGN   = 64
 
+    def __init__(self, name, size, channels = 3, step = None, slots = BUS_SLOTS):
+        """ Create a memory mapped ring of 'slots' 8-bit frames for other processes (see OCVFrameSubscriber)
+            - The ring lives in BUS_PATH (tmpfs if available) and is removed by close()
+            - 'step' is the row size in bytes (defaults to width * channels)
+        """
+        self.name     = name
+        self.path     = OCVFrameBusPath(name)
+        self.size     = tuple(size)
+        self.channels = channels
+        self.step     = step or size[0] * channels
+        self.slots    = slots
+        self.seq      = 0
+        self.stride   = OCVFrameBusStride(self.step, self.size[1])
+
+        # Subscribers only ever see a complete ring: build it aside, then move it in place
+        tmp = "%s.%d.tmp" % (self.path, os.getpid())
+        with open(tmp, "w+b") as f:
+            f.truncate(self.ALIGN + self.stride * slots)
+            self.map = mmap.mmap(f.fileno(), 0)
+
+        self.HEADER.pack_into(self.map, 0, self.MAGIC, self.VERSION, slots, self.size[0], self.size[1], channels, self.step, 0)
+        os.rename(tmp, self.path)
+
+        self.views = None
+        if np is not None:
+            self.views = [OCVFrameBusView(self.map, self.ALIGN + i * self.stride + self.ALIGN, self.size, channels, self.step)
+                          for i in range(slots)]
+
+    def publish(self, frame):
+        """ Write a frame into the next slot (one copy). Returns its sequence number
+            - The frame must have the size and channels of the bus
+        """
+        if (frame.width, frame.height) != self.size or frame.nChannels != self.channels or frame.depth != cv.IPL_DEPTH_8U:
+            raise ValueError("Frame does not match bus %s: %dx%dx%d" % (self.name, self.size[0], self.size[1], self.channels))
+
+        seq    = self.seq + 1
+        slot   = seq % self.slots
+        offset = self.ALIGN + slot * self.stride
+
+        # Mark the slot as being written (start != end) before touching the data
+        struct.pack_into("<Q", self.map, offset, seq)
+
+        if self.views is not None:
+            self.views[slot][...] = OCVNumpyArray(frame)
+        else:
+            data = frame.tostring()
+            if frame.widthStep == self.step:
+                self.map[offset + self.ALIGN:offset + self.ALIGN + len(data)] = data
+            else:
+                row = self.size[0] * self.channels
+                for y in range(self.size[1]):
+                    src = data[y * frame.widthStep:y * frame.widthStep + row]
+                    dst = offset + self.ALIGN + y * self.step
+                    self.map[dst:dst + row] = src
+
+        self.SLOT.pack_into(self.map, offset, seq, seq, time.time())
+        struct.pack_into("<Q", self.map, self.HEADER.size - 8, seq)
+        self.seq = seq
+        return seq
+
+    def close(self):
+        """Unmap and remove the ring (subscribers keep their mapping)"""
+        self.views = None
+        self.map.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+#
+# Class: OCVFrameSubscriber -- Shared Memory Frame Ring (Subscriber)
+#
+class OCVFrameSubscriber:
+
+    def __init__(self, name, timeout = None, poll = BUS_POLL):
+        """ Attach to an OCVFrameBus, waiting up to 'timeout' seconds for it to appear
+            - Frames are read-only views of the ring: clone them before modifying (TrackerImage does)
+            - A view stays valid for about 'slots - 1' frames, check valid() when that matters
+        """
+        path  = OCVFrameBusPath(name)
+        start = time.time()
+        while True:
+            self.map = self.attach(path)
+            if self.map is not None:
+                break
+            if timeout is not None and time.time() - start > timeout:
+                raise IOError("No frame bus '%s'" % name)
+            time.sleep(poll)
+
+        magic, version, slots, width, height, channels, step, head = OCVFrameBus.HEADER.unpack_from(self.map, 0)
+        if version != OCVFrameBus.VERSION:
+            raise IOError("Unsupported frame bus version %d: %s" % (version, path))
+
+        self.name     = name
+        self.poll     = poll
+        self.slots    = slots
+        self.size     = (width, height)
+        self.channels = channels
+        self.step     = step
+        self.stride   = OCVFrameBusStride(step, height)
+        self.last     = head
+        self.frames   = 0
+        self.skipped  = 0
+        self.torn     = 0
+
+    def attach(self, path):
+        """Map the ring at 'path'. None while it is missing or not set up yet (empty, no magic)"""
+        try:
+            with open(path, "rb") as f:
+                map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if len(map) < OCVFrameBus.HEADER.size or map[:len(OCVFrameBus.MAGIC)] != OCVFrameBus.MAGIC:
+            map.close()
+            return None
+        return map
+
+    def head(self):
+        """Get the sequence number of the latest published frame"""
+        return struct.unpack_from("<Q", self.map, OCVFrameBus.HEADER.size - 8)[0]
+
+    def slot(self, seq):
+        """Get the (start, end, timestamp) header of the slot holding 'seq'"""
+        return OCVFrameBus.SLOT.unpack_from(self.map, OCVFrameBus.ALIGN + (seq % self.slots) * self.stride)
+
+    def valid(self, seq):
+        """Check that the slot of 'seq' has not been overwritten (yet)"""
+        start, end, stamp = self.slot(seq)
+        return start == end == seq
+
+    def frame(self, seq):
+        """ Get the frame in the slot of 'seq'
+            - Shares memory with the ring when Numpy is available, copies it otherwise
+        """
+        offset = OCVFrameBus.ALIGN + (seq % self.slots) * self.stride + OCVFrameBus.ALIGN
+        if np is not None:
+            return OCVNumpyImage(OCVFrameBusView(self.map, offset, self.size, self.channels, self.step))
+
+        frame = cv.CreateImageHeader(self.size, cv.IPL_DEPTH_8U, self.channels)
+        cv.SetData(frame, self.map[offset:offset + self.step * self.size[1]], self.step)
+        return frame
+
+    def read(self, timeout = None, copy = False):
+        """ Wait for a frame newer than the last one read
+            - Returns (seq, timestamp, OCVImage) of the latest frame, or None on timeout
+            - Frames published in between are skipped (and counted)
+            - With 'copy' the frame is copied out of the ring (into a pooled frame) and only
+              returned if it was not overwritten meanwhile. Views (the default) can still be
+              overwritten after this returns, check valid() after using them
+        """
+        start = time.time()
+        while True:
+            seq = self.head()
+            if seq != self.last:
+                stamp  = self.slot(seq)[2]
+                frame  = self.frame(seq)
+                missed = max(0, seq - self.last - 1)
+                if copy:
+                    frame = OCVCloneImage(frame)
+
+                if self.valid(seq):
+                    self.skipped += missed
+                    self.frames  += 1
+                    self.last     = seq
+                    return (seq, stamp, OCVImage(frame, noclone=True))
+
+                # Overwritten while reading, drop it and try the next one
+                if copy:
+                    OCVFrames.release(frame)
+                self.torn    += 1
+                self.skipped += missed + 1
+                self.last     = seq
+                continue
+
+            if timeout is not None and time.time() - start > timeout:
+                return None
+            time.sleep(self.poll)
+
+    def close(self):
+        """Detach from the bus"""
+        self.map.close()
+
+    def stats(self):
+        """Get subscriber statistics"""
+        return {
+            "frames"  : self.frames,
+            "skipped" : self.skipped,
+            "torn"    : self.torn,
+            "head"    : self.head()
+        }
+
+def OCVFrameBusPath(name):
+    """Get the file of a frame bus"""
+    return os.path.join(BUS_PATH, "pyocv-%s.bus" % name)
+
+def OCVFrameBusStride(step, height):
+    """Get the size of a frame bus slot (header and frame, aligned)"""
+    size = OCVFrameBus.ALIGN + step * height
+    return (size + OCVFrameBus.ALIGN - 1) / OCVFrameBus.ALIGN * OCVFrameBus.ALIGN
+
+def OCVFrameBusView(buffer, offset, size, channels, step):
+    """Get a (height, width, channels) Numpy view of a frame inside 'buffer'"""
+    return np.ndarray((size[1], size[0], channels), np.uint8, buffer, offset, (step, channels, 1))